@@ -1,87 +1,58 @@
 #!/usr/bin/env python
 
-import json
 import sys
-import urllib.request as request
 import plotly.graph_objects as go
 import pandas as pd
 
+from blockcache import open_cache
+from esclient import Client
 
-def max_block_number(url):
-    body = {"aggs": {"max": {"max": {"field": "number"}}}}
 
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
-    )
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
-        return objs["aggregations"]["max"]["value"]
-    return 0
-
-
-def block_interval(url, tfrom):
-    if tfrom == 0:
-        tfrom = 1
-    body = {
-        "size": 1000,
-        "from": 0,
-        "_source": "interval",
-        "query": {"bool": {"must": [{"range": {"number": {"gt": tfrom}}}]}},
-    }
-
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
-    )
-
-    l = []
-    #print(json.dumps(body).encode("utf8"))
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
+def block_interval(client, indexname, tfrom):
+    """
+    Stream (number, interval) of every block after tfrom, ordered by number
+    """
+    query = {"bool": {"must": [{"range": {"number": {"gt": tfrom}}}]}}
+    for doc in client.scan(indexname, ["number"], ["number", "interval"], query):
+        yield doc["number"], doc.get("interval")
 
-        hits = objs["hits"]["hits"]
 
-        for doc in hits:
-            l.append(doc["_source"]["interval"])
-
-    return l
+def cached_block_interval(cache, tfrom):
+    s = cache.between(tfrom + 1, cache.watermark)
+    number = cache.columns["number"][s].tolist()
+    interval = cache.columns["interval"][s].tolist()
+    return zip(number, interval)
 
 
 def run(host, indexname, output):
-    url = "{}/{}/_search".format(host, indexname)
-
-    max_number = max_block_number(url)
-    if max_number == 0:
-        print("max block number is 0")
-        return
-
-    tfrom = 0
-    l = []
-    while tfrom < max_number:
-        ll = block_interval(url, tfrom)
-        tfrom = tfrom+1000
-
-        for val in ll:
-            l.append(val)
-
-    # draw(x, y, "./test.png")
+    client = Client(host)
+    cache = open_cache(client, host, indexname)
+    if cache:
+        blocks = cached_block_interval(cache, 1)
+    else:
+        blocks = block_interval(client, indexname, 1)
 
     fp = open(output, "wb")
     fp.write("sequence,interval\n".encode("utf8"))
     i = 0
-    for interval in l:
+    pre = None
+    gaps = 0
+    for number, interval in blocks:
+        if pre is not None and number != pre + 1:
+            gaps = gaps + number - pre - 1
+            print("missing blocks {} - {}".format(pre + 1, number - 1))
+        pre = number
+
         s = "{},{}\n".format(i, interval)
         fp.write(s.encode("utf8"))
         i = i + 1
     fp.close()
 
+    if i == 0:
+        print("no blocks found")
+    elif gaps > 0:
+        print("{} blocks missing in index {}".format(gaps, indexname))
+
     #draw(img_output, output)
 
 
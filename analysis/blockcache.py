@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Incremental on-disk cache of the per-block documents of an index.
+#
+# Enabled by pointing ANALYSIS_CACHE at a directory. Every (es host, index)
+# pair gets one compressed columnar .npz file holding number, timestamp_ms,
+# txs, interval, epoch, view and node_id of the cached blocks, plus the
+# watermark (highest cached block number). Each run only fetches the blocks
+# past the watermark.
+
+import hashlib
+import os
+
+import numpy as np
+
+CACHE_ENV = "ANALYSIS_CACHE"
+
+INT_FIELDS = ("number", "timestamp_ms", "txs", "interval", "epoch", "view")
+
+
+class BlockCache:
+    def __init__(self, client, host, indexname, cache_dir):
+        self.client = client
+        self.indexname = indexname
+        key = hashlib.sha1("{}|{}".format(host.rstrip("/"), indexname).encode("utf8")).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, "{}-{}.npz".format(indexname, key))
+
+        self.columns = {f: np.zeros(0, dtype=np.int64) for f in INT_FIELDS}
+        # missing values are stored as -1, node_id is dictionary encoded:
+        # node_idx points into node_ids
+        self.columns["node_idx"] = np.zeros(0, dtype=np.int32)
+        self.node_ids = []
+        self.watermark = 0
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return self
+        with np.load(self.path) as data:
+            for f in self.columns:
+                self.columns[f] = data[f]
+            self.node_ids = data["node_ids"].tolist()
+            self.watermark = int(data["watermark"])
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp.npz"
+        np.savez_compressed(
+            tmp,
+            node_ids=np.array(self.node_ids, dtype=np.str_),
+            watermark=np.int64(self.watermark),
+            **self.columns
+        )
+        os.replace(tmp, self.path)
+
+    def sync(self):
+        """
+        Fetch the blocks past the watermark and append them to the cache
+        """
+        query = {"bool": {"must": [{"range": {"number": {"gt": self.watermark}}}]}}
+        fields = list(INT_FIELDS) + ["node_id"]
+
+        new = {f: [] for f in self.columns}
+        index = {n: i for i, n in enumerate(self.node_ids)}
+        for doc in self.client.scan(self.indexname, ["number"], fields, query):
+            for f in INT_FIELDS:
+                v = doc.get(f)
+                new[f].append(-1 if v is None else v)
+            node_id = doc.get("node_id")
+            if node_id is None:
+                new["node_idx"].append(-1)
+            else:
+                if node_id not in index:
+                    index[node_id] = len(self.node_ids)
+                    self.node_ids.append(node_id)
+                new["node_idx"].append(index[node_id])
+
+        if len(new["number"]) == 0:
+            return self
+
+        for f, col in self.columns.items():
+            self.columns[f] = np.concatenate((col, np.array(new[f], dtype=col.dtype)))
+        self.watermark = int(self.columns["number"][-1])
+        self.save()
+        return self
+
+    def between(self, fromnum, lastnum):
+        """
+        Slice of the cached blocks with fromnum <= number <= lastnum
+        """
+        number = self.columns["number"]
+        return slice(
+            int(np.searchsorted(number, fromnum, side="left")),
+            int(np.searchsorted(number, lastnum, side="right")),
+        )
+
+
+def open_cache(client, host, indexname):
+    """
+    The synced block cache of the index, None if ANALYSIS_CACHE is not set
+    """
+    cache_dir = os.environ.get(CACHE_ENV)
+    if not cache_dir:
+        return None
+    return BlockCache(client, host, indexname, cache_dir).load().sync()
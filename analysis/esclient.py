@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# Shared elasticsearch client for the analysis scripts.
+#
+# One keep-alive connection per thread, gzip compressed responses,
+# filter_path trimming, retry with backoff and _msearch batching.
+
+import gzip
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+
+RETRY_STATUS = (429, 502, 503, 504)
+
+
+class ESError(Exception):
+    def __init__(self, status, reason, body):
+        super().__init__("{} {}: {}".format(status, reason, body[:512]))
+        self.status = status
+        self.body = body
+
+
+class Client:
+    def __init__(self, host, timeout=60, retries=3, backoff=0.5):
+        u = urllib.parse.urlsplit(host if "://" in host else "http://" + host)
+        self.scheme = u.scheme
+        self.netloc = u.netloc
+        self.prefix = u.path.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.scheme == "https":
+                conn = http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def close(self):
+        self._reset()
+
+    def request(self, method, path, body=None, params=None, content_type="application/json"):
+        """
+        Send a request over the pooled connection and decode the json response
+        :param body: dict (sent as json), str or bytes
+        :param params: query string parameters, None values are dropped
+        :return: decoded response
+        """
+        url = self.prefix + path
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+            if params:
+                url = url + "?" + urllib.parse.urlencode(params)
+
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode("utf8")
+
+        headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        if body is not None:
+            headers["Content-Type"] = content_type
+
+        attempt = 0
+        while True:
+            try:
+                conn = self._conn()
+                conn.request(method, url, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                if resp.getheader("Content-Encoding") == "gzip":
+                    data = gzip.decompress(data)
+                if resp.status >= 400:
+                    raise ESError(resp.status, resp.reason, data.decode("utf8", "replace"))
+                return json.loads(data)
+            except (OSError, http.client.HTTPException, ESError) as e:
+                if isinstance(e, ESError) and e.status not in RETRY_STATUS:
+                    raise
+                self._reset()
+                if attempt >= self.retries:
+                    raise
+                # a stale keep-alive connection is retried at once
+                if attempt > 0 or not isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError)):
+                    time.sleep(self.backoff * (2 ** attempt))
+                attempt = attempt + 1
+
+    def search(self, index, body, filter_path=None):
+        return self.request(
+            "POST", "/{}/_search".format(index), body, {"filter_path": filter_path}
+        )
+
+    def get(self, index, doc_id, filter_path=None):
+        return self.request(
+            "GET", "/{}/_doc/{}".format(index, doc_id), None, {"filter_path": filter_path}
+        )
+
+    def msearch(self, index, bodies, filter_path=None, batch=200):
+        """
+        Run many searches in _msearch batches
+        :param bodies: list of search bodies
+        :param filter_path: filter_path of a single response, e.g. "aggregations.sum.value"
+        :return: list of responses in the order of bodies
+        """
+        if filter_path:
+            # keep status so that trimmed responses still line up with bodies
+            filter_path = ",".join(
+                ["responses.status", "responses.error"]
+                + ["responses." + p.strip() for p in filter_path.split(",")]
+            )
+        results = []
+        for i in range(0, len(bodies), batch):
+            lines = []
+            for body in bodies[i:i + batch]:
+                lines.append("{}")
+                lines.append(json.dumps(body))
+            res = self.request(
+                "POST",
+                "/{}/_msearch".format(index),
+                "\n".join(lines) + "\n",
+                {"filter_path": filter_path},
+                content_type="application/x-ndjson",
+            )
+            for r in res["responses"]:
+                if "error" in r:
+                    raise ESError(r.get("status", 500), "msearch", json.dumps(r["error"]))
+                results.append(r)
+        return results
+
+    def composite(self, index, sources, aggs=None, query=None, size=1000):
+        """
+        Iterate over all buckets of a composite aggregation, page by page
+        :param sources: composite sources, e.g. [{"t": {"date_histogram": {...}}}]
+        :param aggs: sub aggregations of every bucket
+        :return: generator of buckets
+        """
+        after = None
+        while True:
+            composite = {"size": size, "sources": sources}
+            if after is not None:
+                composite["after"] = after
+            agg = {"composite": composite}
+            if aggs:
+                agg["aggs"] = aggs
+            body = {"size": 0, "aggs": {"composite": agg}}
+            if query is not None:
+                body["query"] = query
+
+            res = self.search(
+                index,
+                body,
+                filter_path="aggregations.composite.after_key,aggregations.composite.buckets",
+            )
+            objs = res.get("aggregations", {}).get("composite", {})
+            buckets = objs.get("buckets", [])
+            for b in buckets:
+                yield b
+            after = objs.get("after_key")
+            if after is None or len(buckets) < size:
+                return
+
+    def scan(self, index, sort, source=None, query=None, size=5000):
+        """
+        Iterate over all matching documents, paged with search_after
+        :param sort: sort of the search, must be unique per document, e.g. ["number"]
+        :param source: _source filter, e.g. ["number", "interval"]
+        :return: generator of _source
+        """
+        after = None
+        while True:
+            body = {"size": size, "sort": sort, "track_total_hits": False}
+            if source is not None:
+                body["_source"] = source
+            if query is not None:
+                body["query"] = query
+            if after is not None:
+                body["search_after"] = after
+
+            res = self.search(index, body, filter_path="hits.hits._source,hits.hits.sort")
+            hits = res.get("hits", {}).get("hits", [])
+            for h in hits:
+                yield h["_source"]
+            if len(hits) < size:
+                return
+            after = hits[-1]["sort"]
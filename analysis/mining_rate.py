@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 
-import json
 import sys
-import urllib.request as request
+
+import numpy as np
+
+from blockcache import open_cache
+from esclient import Client
 
 default_epoch = 1
 amount = 10
@@ -11,18 +14,25 @@ amount = 10
 class MiningRate:
     def __init__(self, url, indexname, num_validators):
         self.url = url
+        self.client = Client(url)
         self.indexname = indexname
         self.num_validators = int(num_validators)
+        self.cache = open_cache(self.client, url, indexname)
 
     def _last_epoch(self):
+        if self.cache:
+            ts = self.cache.columns["timestamp_ms"]
+            if len(ts) > 0:
+                return int(self.cache.columns["epoch"][np.argmax(ts)])
+            return 0
+
         body = {
             "query": {"bool": {"must": [{"term": {"type": "block"}}]}},
             "size": 1,
             "sort": [{"timestamp": {"order": "desc"}}],
         }
-        url = "{}/{}/_search".format(self.url, self.indexname)
 
-        res = self._post(url, body)
+        res = self._post(body)
         if res:
             hits = res["hits"]["hits"]
             if len(hits) > 0:
@@ -30,94 +40,99 @@ class MiningRate:
                 return doc["epoch"]
         return 0
 
-    def _agg_epoch(self, epoch):
-        body = {
-            "query": {
-                "bool": {
-                    "must": [{"term": {"epoch": epoch}}, {"term": {"type": "block"}}]
-                }
-            },
-            "size": 0,
-            "aggs": {
-                "view": {
-                    "terms": {"field": "view", "size": 1000, "order": {"_key": "asc"}}
-                }
-            },
-        }
-        url = "{}/{}/_search".format(self.url, self.indexname)
-
-        res = self._post(url, body)
-        if res:
-            return res["aggregations"]["view"]["buckets"]
-        return None
-
-    def _get_validator(self, epoch, view):
-        body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term": {"type": "validator"}},
-                        {"term": {"epoch": epoch}},
-                        {"term": {"index": view}},
-                    ]
-                }
+    def _agg_epochs(self, first_epoch, last_epoch):
+        """
+        Count blocks per (epoch, view) of all epochs in [first_epoch, last_epoch)
+        with one composite aggregation
+        :return: numpy arrays of epoch, view and doc_count
+        """
+        if self.cache:
+            epoch = self.cache.columns["epoch"]
+            mask = (epoch >= first_epoch) & (epoch < last_epoch)
+            return epoch[mask], self.cache.columns["view"][mask], np.ones(np.count_nonzero(mask), dtype=np.int64)
+
+        query = {
+            "bool": {
+                "must": [
+                    {"range": {"epoch": {"gte": first_epoch, "lt": last_epoch}}},
+                    {"term": {"type": "block"}},
+                ]
             }
         }
+        sources = [
+            {"epoch": {"terms": {"field": "epoch"}}},
+            {"view": {"terms": {"field": "view"}}},
+        ]
+
+        epochs, views, counts = [], [], []
+        for b in self.client.composite(self.indexname, sources, query=query, size=10000):
+            epochs.append(b["key"]["epoch"])
+            views.append(b["key"]["view"])
+            counts.append(b["doc_count"])
+        return (
+            np.array(epochs, dtype=np.int64),
+            np.array(views, dtype=np.int64),
+            np.array(counts, dtype=np.int64),
+        )
 
-        url = "{}/{}/_search".format(self.url, self.indexname)
+    def _get_validators(self, keys):
+        """
+        Look up the validators of many (epoch, index) keys in _msearch batches
+        :return: dict of (epoch, index) -> validator
+        """
+        bodies = []
+        for (epoch, index) in keys:
+            bodies.append(
+                {
+                    "query": {
+                        "bool": {
+                            "must": [
+                                {"term": {"type": "validator"}},
+                                {"term": {"epoch": epoch}},
+                                {"term": {"index": index}},
+                            ]
+                        }
+                    },
+                    "size": 1,
+                    "_source": ["nodeID", "host"],
+                }
+            )
 
-        res = self._post(url, body)
-        if res:
-            hits = res["hits"]["hits"]
+        validators = dict()
+        res = self.client.msearch(self.indexname, bodies, filter_path="hits.hits._source")
+        for key, r in zip(keys, res):
+            hits = r.get("hits", {}).get("hits", [])
             if len(hits) > 0:
-                return hits[0]["_source"]
-        return None
+                validators[key] = hits[0]["_source"]
+        return validators
 
-    def _post(self, url, body):
-        req = request.Request(
-            url=url,
-            method="POST",
-            data=json.dumps(body).encode("utf8"),
-            headers={"content-type": "application/json"},
-        )
+    def _post(self, body, filter_path=None):
+        return self.client.search(self.indexname, body, filter_path=filter_path)
 
-        with request.urlopen(req) as f:
-            data = f.read()
-            objs = json.loads(data)
-            return objs
-        return None
+    def _uncompleted_views(self, first_epoch, last_epoch):
+        epochs, views, counts = self._agg_epochs(first_epoch, last_epoch)
+
+        # blocks of every (epoch, validator index), epochs without any block stay 0
+        mined = np.zeros((max(last_epoch - first_epoch, 0), self.num_validators), dtype=np.int64)
+        np.add.at(mined, (epochs - first_epoch, views % self.num_validators), counts)
 
-    def _uncompleted_view(self, epoch, views):
-        view_mine = dict()
-        for i in range(self.num_validators):
-            view_mine[i] = {"view": i, "count": 0, "nodeID": "None", "host": "None"}
-
-        for view in views:
-            view_number = view["key"]
-            index = view_number % self.num_validators
-            v = view_mine[index]
-            v["count"] = v["count"] + view["doc_count"]
-            view_mine[index] = v
-
-        uncompleted = []
-        for _, view in view_mine.items():
-            if view["count"] < amount:
-                validator = self._get_validator(epoch, view["view"])
-                if validator:
-                    view["nodeID"] = validator["nodeID"]
-                    view["host"] = validator["host"]
-                uncompleted.append(view)
+        rows, indexes = np.nonzero(mined < amount)
+        keys = [(int(r) + first_epoch, int(i)) for r, i in zip(rows, indexes)]
+        validators = self._get_validators(keys)
+
+        uncompleted = dict()
+        for (epoch, index) in keys:
+            view = {"view": index, "count": int(mined[epoch - first_epoch, index]), "nodeID": "None", "host": "None"}
+            validator = validators.get((epoch, index))
+            if validator:
+                view["nodeID"] = validator["nodeID"]
+                view["host"] = validator["host"]
+            uncompleted.setdefault(epoch, []).append(view)
         return uncompleted
 
     def uncompleted_mining_rate(self):
         last_epoch = self._last_epoch()
-        uncompleted = dict()
-        for i in range(default_epoch + 1, last_epoch, 1):
-            aggs = self._agg_epoch(i)
-
-            views = self._uncompleted_view(i, aggs)
-            if views:
-                uncompleted[i] = views
+        uncompleted = self._uncompleted_views(default_epoch + 1, last_epoch)
 
         for epoch, views in uncompleted.items():
             uncompleted[epoch] = sorted(views, key=lambda k: k["count"], reverse=True)
@@ -153,9 +168,8 @@ class MiningRate:
             "size": 0,
             "aggs": {"vds": {"terms": {"field": "nodeID.keyword", "size": 1000}}},
         }
-        url = "{}/{}/_search".format(self.url, self.indexname)
 
-        res = self._post(url, body)
+        res = self._post(body)
 
         if res:
             buckets = res["aggregations"]["vds"]["buckets"]
@@ -169,52 +183,63 @@ class MiningRate:
             return vds
         return None
 
-    def _num_blocks(self, nodeid, last_epoch):
+    def _num_blocks(self, last_epoch):
+        if self.cache:
+            epoch = self.cache.columns["epoch"]
+            node_idx = self.cache.columns["node_idx"]
+            mask = (epoch > 1) & (epoch < last_epoch) & (node_idx >= 0)
+            counts = np.bincount(node_idx[mask], minlength=len(self.cache.node_ids))
+            return {n: int(c) for n, c in zip(self.cache.node_ids, counts) if c > 0}
+
         body = {
             "query": {
                 "bool": {
                     "must": [
                         {"term": {"type": "block"}},
-                        {"term": {"node_id": nodeid}},
                         {"range": {"epoch": {"gt": 1, "lt": last_epoch}}},
                     ]
                 }
             },
             "size": 0,
+            "aggs": {"nodes": {"terms": {"field": "node_id.keyword", "size": 1000}}},
         }
 
-        url = "{}/{}/_search".format(self.url, self.indexname)
-
-        res = self._post(url, body)
+        res = self._post(body, filter_path="aggregations.nodes.buckets")
+        blocks = dict()
         if res:
-            return res["hits"]["total"]["value"]
-        return 0
+            for b in res.get("aggregations", {}).get("nodes", {}).get("buckets", []):
+                blocks[b["key"]] = b["doc_count"]
+        return blocks
 
-    def _validator(self, nodeid):
+    def _validator_hosts(self):
         body = {
-            "query": {
-                "bool": {
-                    "must": [
-                        {"term": {"type": "validator"}},
-                        {"term": {"nodeID": nodeid}},
-                    ]
+            "query": {"bool": {"must": [{"term": {"type": "validator"}}]}},
+            "size": 0,
+            "aggs": {
+                "vds": {
+                    "terms": {"field": "nodeID.keyword", "size": 1000},
+                    "aggs": {"host": {"top_hits": {"size": 1, "_source": ["host"]}}},
                 }
             },
-            "size": 1,
         }
-        url = "{}/{}/_search".format(self.url, self.indexname)
-        res = self._post(url, body)
+
+        res = self._post(body, filter_path="aggregations.vds.buckets")
+        hosts = dict()
         if res:
-            return res["hits"]["hits"][0]["_source"]["host"]
-        return None
+            for b in res.get("aggregations", {}).get("vds", {}).get("buckets", []):
+                hits = b["host"]["hits"]["hits"]
+                if len(hits) > 0:
+                    hosts[b["key"]] = hits[0]["_source"]["host"]
+        return hosts
 
     def _fill_mining(self, vds, last_epoch):
+        blocks = self._num_blocks(last_epoch)
+        hosts = self._validator_hosts()
+
         new_vds = dict()
         for k, vd in vds.items():
-            c = self._num_blocks(k, last_epoch)
-            h = self._validator(k)
-            vd["count"] = c
-            vd["host"] = h
+            vd["count"] = blocks.get(k, 0)
+            vd["host"] = hosts.get(k)
             rate = vd["count"] / (vd["rounds"] * 10)
             vd["rate"] = rate * 100
             new_vds[k] = vd
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Minimal PlatON JSON-RPC clients for the live monitors.
+#
+# HTTPClient keeps one keep-alive connection, WSClient keeps one websocket
+# (requires `pip install websockets`) and supports subscriptions. Both send
+# several calls as one JSON-RPC batch request. Like controller/platon_rpc.py,
+# a batch returns an RPCError in place of a failed call and a timed out
+# request is not retried.
+
+import asyncio
+import http.client
+import itertools
+import json
+import socket
+import urllib.parse
+
+
+class RPCError(Exception):
+    pass
+
+
+def to_int(v):
+    if isinstance(v, str):
+        return int(v, 16) if v.startswith("0x") else int(v)
+    return v
+
+
+def _result(resp):
+    if "error" in resp:
+        raise RPCError("{}: {}".format(resp["error"].get("code"), resp["error"].get("message")))
+    return resp.get("result")
+
+
+def _results(reqs, resps):
+    """
+    Results of a batch in the order of reqs, an RPCError in place of a
+    failed call, as the controller's platon_rpc returns them
+    """
+    resps = {r["id"]: r for r in resps}
+    results = []
+    for r in reqs:
+        try:
+            results.append(_result(resps[r["id"]]))
+        except RPCError as e:
+            results.append(e)
+    return results
+
+
+class HTTPClient:
+    def __init__(self, url, timeout=10):
+        u = urllib.parse.urlsplit(url)
+        self.netloc = u.netloc
+        self.path = u.path or "/"
+        self.https = u.scheme == "https"
+        self.timeout = timeout
+        self.conn = None
+        self.ids = itertools.count(1)
+
+    def _post(self, payload):
+        data = json.dumps(payload).encode("utf8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in range(2):
+            if self.conn is None:
+                cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+                self.conn = cls(self.netloc, timeout=self.timeout)
+            try:
+                self.conn.request("POST", self.path, body=data, headers=headers)
+                resp = self.conn.getresponse()
+                return json.loads(resp.read())
+            except socket.timeout:
+                self.close()
+                raise
+            except (OSError, http.client.HTTPException):
+                self.close()
+                # retry once on a stale keep-alive connection
+                if attempt > 0:
+                    raise
+
+    def call(self, method, *params):
+        return _result(self._post({"jsonrpc": "2.0", "id": next(self.ids), "method": method, "params": list(params)}))
+
+    def batch(self, calls):
+        """
+        :param calls: list of (method, params)
+        :return: list of results in the order of calls, an RPCError in
+                 place of a failed call
+        """
+        if not calls:
+            return []
+        reqs = [
+            {"jsonrpc": "2.0", "id": next(self.ids), "method": m, "params": list(p)}
+            for (m, p) in calls
+        ]
+        return _results(reqs, self._post(reqs))
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+
+
+class WSClient:
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.ws = None
+        self.ids = itertools.count(1)
+        self.pending = dict()
+        self.subscriptions = dict()
+        self.reader = None
+
+    async def connect(self):
+        import websockets
+
+        self.ws = await asyncio.wait_for(websockets.connect(self.url, max_size=None), self.timeout)
+        self.reader = asyncio.ensure_future(self._read())
+        return self
+
+    async def _read(self):
+        try:
+            async for msg in self.ws:
+                objs = json.loads(msg)
+                if isinstance(objs, list):
+                    # a batch is pending under the id of its first call,
+                    # but the responses may come back in any order
+                    for r in objs:
+                        fut = self.pending.pop(r.get("id"), None)
+                        if fut is not None:
+                            if not fut.done():
+                                fut.set_result(objs)
+                            break
+                elif objs.get("method", "").endswith("_subscription"):
+                    params = objs["params"]
+                    # notifications may arrive before subscribe() got its id back
+                    queue = self.subscriptions.setdefault(params["subscription"], asyncio.Queue())
+                    queue.put_nowait(params["result"])
+                else:
+                    fut = self.pending.pop(objs.get("id"), None)
+                    if fut and not fut.done():
+                        fut.set_result(objs)
+        except Exception as e:
+            err = e
+        else:
+            err = RPCError("connection closed")
+        for fut in self.pending.values():
+            if not fut.done():
+                fut.set_exception(err)
+        self.pending.clear()
+        for queue in self.subscriptions.values():
+            queue.put_nowait(err)
+
+    async def _send(self, payload, key):
+        fut = asyncio.get_event_loop().create_future()
+        self.pending[key] = fut
+        await self.ws.send(json.dumps(payload))
+        return await asyncio.wait_for(fut, self.timeout)
+
+    async def call(self, method, *params):
+        i = next(self.ids)
+        resp = await self._send({"jsonrpc": "2.0", "id": i, "method": method, "params": list(params)}, i)
+        return _result(resp)
+
+    async def batch(self, calls):
+        if not calls:
+            return []
+        reqs = [
+            {"jsonrpc": "2.0", "id": next(self.ids), "method": m, "params": list(p)}
+            for (m, p) in calls
+        ]
+        return _results(reqs, await self._send(reqs, reqs[0]["id"]))
+
+    async def subscribe(self, kind, namespace="platon"):
+        """
+        :return: asyncio.Queue receiving every notification, or the
+                 exception that closed the connection
+        """
+        sub = await self.call(namespace + "_subscribe", kind)
+        return self.subscriptions.setdefault(sub, asyncio.Queue())
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await asyncio.gather(self.reader, return_exceptions=True)
@@ -1,40 +1,223 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-#   @Time    : 2019/12/19 14:32
-#   @Author  : PlatON-Developer
-#   @Site    : https://github.com/PlatONnetwork/
+#   @Time    : 2019/12/19 14:32
+#   @Author  : PlatON-Developer
+#   @Site    : https://github.com/PlatONnetwork/
 
-import os
+import asyncio
+import json
 import sys
 import time
-from dump import run, BASE_DIR
+from collections import deque
 
+from platon_rpc import HTTPClient, WSClient, to_int
 
-PLATON_BIN = os.path.join(BASE_DIR, "platon")
+WINDOWS = (10, 60)
+MAX_BATCH = 100
 
 
-def chmod(*args):
-    base_cmd = "sudo chmod +x "
-    for arg in args:
-        cmd = base_cmd + arg
-        run(cmd)
+class TPSMeter:
+    """
+    Instantaneous and rolling TPS of a stream of blocks
+    """
 
+    def __init__(self, windows=WINDOWS):
+        self.windows = windows
+        self.blocks = deque()
+        self.pre_timestamp = None
 
-def get_txs(url):
-    cmd = "{} attach {} --exec 'platon.getBlock(platon.blockNumber).transactions.length'".format(PLATON_BIN, url)
-    return run(cmd)
+    def add(self, number, timestamp, txs):
+        interval = 0
+        if self.pre_timestamp is not None:
+            interval = timestamp - self.pre_timestamp
+        self.pre_timestamp = timestamp
+
+        self.blocks.append((timestamp, txs))
+        while self.blocks[0][0] <= timestamp - max(self.windows) * 1000:
+            self.blocks.popleft()
+
+        stat = {
+            "number": number,
+            "txs": txs,
+            "interval": interval,
+            "tps": txs / (interval / 1000) if interval > 0 else 0,
+        }
+        for w in self.windows:
+            total = sum(t for (ts, t) in self.blocks if ts > timestamp - w * 1000)
+            stat["tps_{}s".format(w)] = total / w
+        return stat
+
+
+def block_calls(numbers, headers):
+    """
+    RPC calls for the transaction count and timestamp of every block,
+    blocks whose header is already known only need the count
+    """
+    calls = []
+    for n in numbers:
+        if n in headers:
+            calls.append(("platon_getBlockTransactionCountByNumber", [hex(n)]))
+        else:
+            calls.append(("platon_getBlockByNumber", [hex(n), False]))
+    return calls
+
+
+def parse_blocks(numbers, headers, results):
+    for n, r in zip(numbers, results):
+        if isinstance(r, Exception):
+            raise r
+        if r is None:
+            continue
+        if n in headers:
+            yield n, to_int(headers[n]["timestamp"]), to_int(r)
+        else:
+            yield n, to_int(r["timestamp"]), len(r["transactions"])
+
+
+def show(stat):
+    print(
+        "block: {:<10} txs: {:<8} interval: {:<8} tps: {:<10.2f} tps_10s: {:<10.2f} tps_60s: {:<10.2f}".format(
+            stat["number"], stat["txs"], stat["interval"], stat["tps"], stat["tps_10s"], stat["tps_60s"]
+        ),
+        flush=True,
+    )
+
+
+async def follow_heads(client, report):
+    heads = await client.subscribe("newHeads")
+    meter = TPSMeter()
+    last = None
+    while True:
+        headers = dict()
+        head = await heads.get()
+        while True:
+            if isinstance(head, Exception):
+                raise head
+            headers[to_int(head["number"])] = head
+            if heads.empty():
+                break
+            head = heads.get_nowait()
+
+        number = max(headers)
+        if last is None:
+            last = number - 1
+        for i in range(last + 1, number + 1, MAX_BATCH):
+            numbers = list(range(i, min(i + MAX_BATCH, number + 1)))
+            results = await client.batch(block_calls(numbers, headers))
+            for block in parse_blocks(numbers, headers, results):
+                report(meter.add(*block))
+        last = max(last, number)
+
+
+async def watch_ws(url, report):
+    client = await WSClient(url).connect()
+    try:
+        await follow_heads(client, report)
+    finally:
+        await client.close()
+
+
+def watch_http(url, report, poll=0.2):
+    client = HTTPClient(url)
+    meter = TPSMeter()
+    last = None
+    while True:
+        number = to_int(client.call("platon_blockNumber"))
+        if last is None:
+            last = number - 1
+        for i in range(last + 1, number + 1, MAX_BATCH):
+            numbers = list(range(i, min(i + MAX_BATCH, number + 1)))
+            results = client.batch(block_calls(numbers, {}))
+            for block in parse_blocks(numbers, {}, results):
+                report(meter.add(*block))
+        last = max(last, number)
+        time.sleep(poll)
+
+
+async def watch_node(node, row, poll=1):
+    url = "ws://{}:{}".format(node["host"], node["ws_port"])
+    while True:
+        try:
+            client = await WSClient(url).connect()
+        except Exception as e:
+            row["status"] = "connect: {}".format(e)
+            await asyncio.sleep(3)
+            continue
+
+        async def txpool():
+            while True:
+                pool = await client.call("txpool_status")
+                row["pending"] = to_int(pool["pending"])
+                await asyncio.sleep(poll)
+
+        row["status"] = "ok"
+        poller = asyncio.ensure_future(txpool())
+        try:
+            await asyncio.gather(follow_heads(client, row.update), poller)
+        except Exception as e:
+            row["status"] = "error: {}".format(e)
+        finally:
+            poller.cancel()
+            await client.close()
+        await asyncio.sleep(3)
+
+
+def render(nodes, rows):
+    highest = max([r["number"] for r in rows if "number" in r] or [0])
+    lines = [
+        "|{:<20} | {:<22} | {:<10} | {:<6} | {:<10} | {:<10} | {:<8} | {:<20}|".format(
+            "Node", "Host", "Head", "Lag", "TPS", "TPS(10s)", "Pending", "Status"
+        )
+    ]
+    for node, r in zip(nodes, rows):
+        head = r.get("number")
+        lines.append(
+            "|{:<20} | {:<22} | {:<10} | {:<6} | {:<10.2f} | {:<10.2f} | {:<8} | {:<20}|".format(
+                node["name"][:20],
+                "{}:{}".format(node["host"], node["ws_port"]),
+                "-" if head is None else head,
+                "-" if head is None else highest - head,
+                r.get("tps", 0),
+                r.get("tps_10s", 0),
+                r.get("pending", "-"),
+                r.get("status", "")[:20],
+            )
+        )
+    # move the cursor home and clear, so the table refreshes in place
+    print("\033[H\033[J" + "\n".join(lines), flush=True)
+
+
+async def dashboard(nodes, refresh=1):
+    rows = [{"status": "connecting"} for _ in nodes]
+    tasks = [asyncio.ensure_future(watch_node(n, r)) for n, r in zip(nodes, rows)]
+    try:
+        while True:
+            render(nodes, rows)
+            await asyncio.sleep(refresh)
+    finally:
+        for t in tasks:
+            t.cancel()
 
 
 def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "nodes":
+        with open(sys.argv[2]) as fp:
+            nodes = json.load(fp)
+        try:
+            asyncio.run(dashboard(nodes))
+        except KeyboardInterrupt as e:
+            print(e)
+        return
+
     if len(sys.argv) >= 2:
         url = sys.argv[1]
     else:
         url = "ws://localhost:8808"
-    chmod(PLATON_BIN)
     try:
-        while True:
-            print(get_txs(url))
-            time.sleep(1)
+        if url.startswith("ws"):
+            asyncio.run(watch_ws(url, show))
+        else:
+            watch_http(url, show)
     except KeyboardInterrupt as e:
         print(e)
 
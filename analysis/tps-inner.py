@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 
-import json
 import sys
-import urllib.request as request
 
+from esclient import Client
 
-def txs_count(host, indexname, fromnum, lastnum):
+
+def txs_count(client, indexname, fromnum, lastnum):
     body = {
         "query": {
             "bool": {"must": [{"range": {"number": {"gte": fromnum, "lte": lastnum}}}]}
@@ -14,40 +14,14 @@ def txs_count(host, indexname, fromnum, lastnum):
         "aggs": {"sum": {"sum": {"field": "txs"}}},
     }
 
-    url = "{}/{}/_search".format(host, indexname)
-
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
-    )
-
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
-
-        txs = objs["aggregations"]["sum"]["value"]
-        return txs
-
-    return 0
-
-
-def span_time(host, indexname, fromnum, lastnum):
-    url0 = "{}/{}/_doc/block_{}".format(host, indexname, fromnum)
-    url1 = "{}/{}/_doc/block_{}".format(host, indexname, lastnum)
+    objs = client.search(indexname, body, filter_path="aggregations.sum.value")
+    return objs["aggregations"]["sum"]["value"]
 
-    t0 = 0
-    with request.urlopen(url0) as f:
-        data = f.read()
-        objs = json.loads(data)
-        t0 = objs["_source"]["timestamp_ms"]
 
-    t1 = 0
-    with request.urlopen(url1) as f:
-        data = f.read()
-        objs = json.loads(data)
-        t1 = objs["_source"]["timestamp_ms"]
+def span_time(client, indexname, fromnum, lastnum):
+    fp = "_source.timestamp_ms"
+    t0 = client.get(indexname, "block_{}".format(fromnum), filter_path=fp)["_source"]["timestamp_ms"]
+    t1 = client.get(indexname, "block_{}".format(lastnum), filter_path=fp)["_source"]["timestamp_ms"]
 
     return t1 - t0
 
@@ -65,14 +39,10 @@ if __name__ == "__main__":
         print("Usage: %s <url> <index_name> <start> <end>" % (sys.argv[0]))
         sys.exit(0)
     print("{:<15} {:<18} {:<20} {:<30}".format("Range", "Transactions", "Span", "TPS"))
-    url = sys.argv[1]
+    client = Client(sys.argv[1])
     index_name = sys.argv[2]
     fromnum = int(sys.argv[3])
     lastnum = int(sys.argv[4])
-    show(
-        fromnum,
-        lastnum,
-        txs_count(url, index_name, fromnum, lastnum),
-        span_time(url, index_name, fromnum, lastnum),
-        tps(txs_count(url, index_name, fromnum, lastnum), span_time(url, index_name, fromnum, lastnum)),
-    )
+    txs = txs_count(client, index_name, fromnum, lastnum)
+    spans = span_time(client, index_name, fromnum, lastnum)
+    show(fromnum, lastnum, txs, spans, tps(txs, spans))
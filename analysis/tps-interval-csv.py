@@ -1,93 +1,130 @@
 #!/usr/bin/env python
 
-import json
 import sys
-import urllib.request as request
+import numpy as np
 import plotly.graph_objects as go
 import pandas as pd
 
+from blockcache import open_cache
+from esclient import Client
 
-def min_timestamp(url):
+
+def min_timestamp(client, indexname):
     body = {
         "query": {"bool": {"must": [{"range": {"number": {"gte": 1}}}]}},
         "size": 0,
         "aggs": {"min_t": {"min": {"field": "timestamp_ms"}}},
     }
 
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
-    )
-
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
+    objs = client.search(indexname, body, filter_path="aggregations.min_t.value")
+    return objs["aggregations"]["min_t"]["value"] or 0
 
-        t = objs["aggregations"]["min_t"]["value"]
-        return t
-    return 0
 
-
-def max_timestamp(url):
+def max_timestamp(client, indexname):
     body = {
         "query": {"bool": {"must": [{"range": {"number": {"gte": 1}}}]}},
         "size": 0,
         "aggs": {"max_t": {"max": {"field": "timestamp_ms"}}},
     }
 
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
-    )
-
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
-
-        t = objs["aggregations"]["max_t"]["value"]
-        return t
-    return 0
-
-
-def count_txs(url, tfrom, tend):
-    body = {
-        "size": 0,
-        "aggs": {
-            "interval": {
-                "date_range": {
-                    "field": "timestamp_ms",
-                    "ranges": [{"from": tfrom, "to": tend}],
+    objs = client.search(indexname, body, filter_path="aggregations.max_t.value")
+    return objs["aggregations"]["max_t"]["value"] or 0
+
+
+def count_txs(client, indexname, windows):
+    """
+    Aggregate txs of every (tfrom, tend) window, batched with _msearch
+    """
+    bodies = []
+    for (tfrom, tend) in windows:
+        bodies.append(
+            {
+                "size": 0,
+                "aggs": {
+                    "interval": {
+                        "date_range": {
+                            "field": "timestamp_ms",
+                            "ranges": [{"from": tfrom, "to": tend}],
+                        },
+                        "aggs": {"sum": {"sum": {"field": "txs"}}},
+                    }
                 },
-                "aggs": {"sum": {"sum": {"field": "txs"}}},
             }
-        },
-    }
+        )
 
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
+    res = client.msearch(
+        indexname, bodies, filter_path="aggregations.interval.buckets"
     )
+    return [r["aggregations"]["interval"]["buckets"][0]["sum"]["value"] for r in res]
 
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
 
-        buckets = objs["aggregations"]["interval"]["buckets"]
-        return buckets[0]["sum"]["value"]
-    return 0
+def txs_per_second(client, indexname, begin, seconds):
+    """
+    Sum txs of every second in [begin, begin + seconds * 1000) with one
+    date_histogram, paginated as a composite aggregation
+    :return: numpy array, one slot per second
+    """
+    per_second = np.zeros(seconds)
+    if seconds <= 0:
+        return per_second
 
-
-def run(host, indexname, mov, output):
-    url = "{}/{}/_search".format(host, indexname)
-
-    min_t = min_timestamp(url)
-    max_t = max_timestamp(url)
+    query = {
+        "range": {"timestamp_ms": {"gte": begin, "lt": begin + seconds * 1000}}
+    }
+    sources = [{"t": {"date_histogram": {"field": "timestamp_ms", "fixed_interval": "1s"}}}]
+    aggs = {"sum": {"sum": {"field": "txs"}}}
+
+    for b in client.composite(indexname, sources, aggs, query, size=10000):
+        i = int((b["key"]["t"] - begin) // 1000)
+        if 0 <= i < seconds:
+            per_second[i] = b["sum"]["value"] or 0
+    return per_second
+
+
+def cached_txs_per_second(cache, begin, seconds):
+    """
+    Same as txs_per_second, computed from the local block cache
+    """
+    if seconds <= 0:
+        return np.zeros(0)
+    ts = cache.columns["timestamp_ms"]
+    txs = cache.columns["txs"]
+    mask = (ts >= begin) & (ts < begin + seconds * 1000) & (txs > 0)
+    return np.bincount(
+        (ts[mask] - begin) // 1000, weights=txs[mask], minlength=seconds
+    ).astype(np.float64)
+
+
+def moving_txs(client, indexname, windows, mov, cache=None):
+    """
+    Same results as count_txs for the consecutive one-second-step windows,
+    computed locally from the per-second series with a rolling sum
+    """
+    if not windows:
+        return []
+    seconds = len(windows) + mov - 1
+    if cache:
+        per_second = cached_txs_per_second(cache, windows[0][0], seconds)
+    else:
+        per_second = txs_per_second(client, indexname, windows[0][0], seconds)
+    cum = np.concatenate(([0.0], np.cumsum(per_second)))
+    return (cum[mov:mov + len(windows)] - cum[:len(windows)]).tolist()
+
+
+def run(host, indexname, mov, output, mode="histogram"):
+    client = Client(host)
+    cache = None
+    if mode != "window":
+        cache = open_cache(client, host, indexname)
+
+    if cache:
+        ts = cache.columns["timestamp_ms"]
+        ts = ts[ts >= 0]
+        min_t = int(ts.min()) if len(ts) > 0 else 0
+        max_t = int(ts.max()) if len(ts) > 0 else 0
+    else:
+        min_t = min_timestamp(client, indexname)
+        max_t = max_timestamp(client, indexname)
 
     if min_t == 0 or max_t == 0 or max_t < min_t:
         print("invalid time: min: %d max: %d\n" % (min_t, max_t))
@@ -99,17 +136,25 @@ def run(host, indexname, mov, output):
     # end = begin + 9 * interval
     end = begin + mov * interval
     #sstep = 1
+    windows = []
+    while end < max_t:
+        windows.append((begin, end))
+        begin = begin + interval
+        end = end + interval
+
     c = 0
     l = []
     x = []
     y = []
-    while end < max_t:
-        count = count_txs(url, begin, end)
+    if mode == "window":
+        counts = count_txs(client, indexname, windows)
+    else:
+        counts = moving_txs(client, indexname, windows, mov, cache)
+
+    for count in counts:
         l.append((c * step, count, count / mov))
         x.append(c * step)
         y.append(count / step)
-        begin = begin + interval
-        end = end + interval
         c = c + 1
 
     # draw(x, y, "./test.png")
@@ -135,6 +180,6 @@ def draw(img_file, csv_file):
 
 if __name__ == "__main__":
     if len(sys.argv) < 5:
-        print("{} <url> <indexname> <mov> <output csv>".format(sys.argv[0]))
+        print("{} <url> <indexname> <mov> <output csv> [histogram|window]".format(sys.argv[0]))
         sys.exit(0)
-    run(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    run(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4], *sys.argv[5:6])
@@ -1,125 +1,93 @@
 #!/usr/bin/env python
 
-import json
 import sys
-import urllib.request as request
+from collections import deque
 import plotly.graph_objects as go
 import pandas as pd
 
-
-def min_timestamp(url):
-    body = {
-        "query": {"bool": {"must": [{"range": {"number": {"gte": 1}}},]}},
-        "size": 0,
-        "aggs": {"min_t": {"min": {"field": "timestamp_ms"}}},
-    }
-
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
-    )
-
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
-
-        t = objs["aggregations"]["min_t"]["value"]
-        return t
-    return 0
-
-
-def max_timestamp(url):
-    body = {
-        "query": {"bool": {"must": [{"range": {"number": {"gte": 1}}}]}},
-        "size": 0,
-        "aggs": {"max_t": {"max": {"field": "timestamp_ms"}}},
-    }
-
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
-    )
-
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
-
-        t = objs["aggregations"]["max_t"]["value"]
-        return t
-    return 0
-
-
-def max_txs(url, tfrom, tend):
-    body = {
-        "size": 0,
-        "aggs": {
-            "interval": {
-                "date_range": {
-                    "field": "timestamp_ms",
-                    "ranges": [{"from": tfrom, "to": tend}],
-                },
-                "aggs": {"max": {"max": {"field": "txs"}}},
-            }
-        },
-    }
-
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
-    )
-
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
-
-        buckets = objs["aggregations"]["interval"]["buckets"]
-        return buckets[0]["max"]["value"]
-    return 0
-
-
-def run(host, indexname, mov, output):
-    url = "{}/{}/_search".format(host, indexname)
-
-    min_t = min_timestamp(url)
-    max_t = max_timestamp(url)
+from esclient import Client
+
+
+def block_txs(client, indexname):
+    """
+    Fetch the per-block (timestamp_ms, txs) series once, ordered by number
+    """
+    ts = []
+    txs = []
+    query = {"bool": {"must": [{"range": {"number": {"gte": 1}}}]}}
+    for doc in client.scan(indexname, ["number"], ["timestamp_ms", "txs"], query):
+        if doc.get("timestamp_ms") is None:
+            continue
+        ts.append(doc["timestamp_ms"])
+        txs.append(doc.get("txs") or 0)
+    return ts, txs
+
+
+def sliding_max(ts, txs, begin, end, window, stride):
+    """
+    Max txs of the blocks in every [start, start + window) window, start
+    moving from begin by stride while start + window < end, computed with
+    a monotonic deque in O(blocks + windows)
+    :return: list of max txs, None for a window without blocks
+    """
+    order = sorted(range(len(ts)), key=lambda i: ts[i])
+    t = [ts[i] for i in order]
+    x = [txs[i] for i in order]
+
+    result = []
+    dq = deque()
+    hi = 0
+    start = begin
+    while start + window < end:
+        while hi < len(t) and t[hi] < start + window:
+            while dq and x[dq[-1]] <= x[hi]:
+                dq.pop()
+            dq.append(hi)
+            hi = hi + 1
+        while dq and t[dq[0]] < start:
+            dq.popleft()
+        result.append(x[dq[0]] if dq else None)
+        start = start + stride
+    return result
+
+
+def run(host, indexname, movs, output, stride=None):
+    client = Client(host)
+
+    ts, txs = block_txs(client, indexname)
+
+    min_t = min(ts) if ts else 0
+    max_t = max(ts) if ts else 0
 
     if min_t == 0 or max_t == 0 or max_t < min_t:
         print("invalid time: min: %d max: %d\n" % (min_t, max_t))
         return
 
-    step = 1
-    interval = mov * 1000
+    if stride is None:
+        stride = min(movs)
     begin = int(min_t / 1000) * 1000
-    # end = begin + 9 * interval
-    end = begin + interval
-    #sstep = 1
-    c = 0
-    l = []
-    x = []
-    y = []
-    while end < max_t:
-        count = max_txs(url, begin, end)
-        if count is None:
-            count = 0
-        l.append((c * step, count))
-        x.append(c * step)
-        y.append(count)
-        begin = begin + interval
-        end = begin + interval
-        c = c + 1
-
-    # draw(x, y, "./test.png")
+
+    columns = []
+    for mov in movs:
+        columns.append(sliding_max(ts, txs, begin, max_t, mov * 1000, stride * 1000))
 
     fp = open(output, "wb")
-    fp.write("sequence,txs\n".encode("utf8"))
-    for (idx, count) in l:
-        s = "{},{}\n".format(idx, count)
+    if len(movs) == 1:
+        fp.write("sequence,txs\n".encode("utf8"))
+    else:
+        header = ",".join(["sequence"] + ["txs_{}s".format(mov) for mov in movs])
+        fp.write((header + "\n").encode("utf8"))
+    rows = max(len(c) for c in columns)
+    for idx in range(rows):
+        values = []
+        for c in columns:
+            if idx >= len(c):
+                values.append("")
+            elif c[idx] is None:
+                values.append("0")
+            else:
+                values.append("{}".format(float(c[idx])))
+        s = "{},{}\n".format(idx, ",".join(values))
         fp.write(s.encode("utf8"))
     fp.close()
 
@@ -137,6 +105,8 @@ def draw(img_file, csv_file):
 
 if __name__ == "__main__":
     if len(sys.argv) < 5:
-        print("{} <url> <indexname> <mov> <output csv>".format(sys.argv[0]))
+        print("{} <url> <indexname> <mov[,mov...]> <output csv> [stride]".format(sys.argv[0]))
         sys.exit(0)
-    run(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    movs = [int(m) for m in sys.argv[3].split(",")]
+    stride = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    run(sys.argv[1], sys.argv[2], movs, sys.argv[4], stride)
@@ -1,58 +1,73 @@
 #!/usr/bin/env python
 
-import json
 import sys
-import urllib.request as request
 
+from blockcache import open_cache
+from esclient import Client
 
-def txs_count(host, indexname, fromnum, lastnum):
+default_ranges = [(501, 10501), (501, 20501), (501, 30501)]
+
+
+def range_stats(client, indexname, ranges):
+    """
+    Compute txs/span of every block range with one multi-range aggregation
+    :param ranges: list of (fromnum, lastnum), both inclusive
+    :return: dict of (fromnum, lastnum) -> (txs, spans)
+    """
     body = {
-        "query": {
-            "bool": {"must": [{"range": {"number": {"gte": fromnum, "lte": lastnum}}}]}
-        },
         "size": 0,
-        "aggs": {"sum": {"sum": {"field": "txs"}}},
+        "aggs": {
+            "ranges": {
+                "range": {
+                    "field": "number",
+                    "keyed": True,
+                    "ranges": [
+                        {"key": "{}-{}".format(f, l), "from": f, "to": l + 1}
+                        for (f, l) in ranges
+                    ],
+                },
+                "aggs": {
+                    "sum": {"sum": {"field": "txs"}},
+                    "min_t": {"min": {"field": "timestamp_ms"}},
+                    "max_t": {"max": {"field": "timestamp_ms"}},
+                },
+            }
+        },
     }
 
-    url = "{}/{}/_search".format(host,indexname)
-
-    req = request.Request(
-        url=url,
-        method="POST",
-        data=json.dumps(body).encode("utf8"),
-        headers={"content-type": "application/json"},
+    objs = client.search(
+        indexname, body, filter_path="aggregations.ranges.buckets.*.*.value"
     )
+    buckets = objs["aggregations"]["ranges"]["buckets"]
 
-    with request.urlopen(req) as f:
-        data = f.read()
-        objs = json.loads(data)
+    stats = dict()
+    for (f, l) in ranges:
+        b = buckets["{}-{}".format(f, l)]
+        t0 = b.get("min_t", {}).get("value") or 0
+        t1 = b.get("max_t", {}).get("value") or 0
+        stats[(f, l)] = (b["sum"]["value"], t1 - t0)
 
-        txs = objs["aggregations"]["sum"]["value"]
-        return txs
+    return stats
 
-    return 0
 
-
-def span_time(host, indexname, fromnum, lastnum):
-    url0 = "{}/{}/_doc/block_{}".format(host, indexname, fromnum)
-    url1 = "{}/{}/_doc/block_{}".format(host, indexname, lastnum)
-
-    t0 = 0
-    with request.urlopen(url0) as f:
-        data = f.read()
-        objs = json.loads(data)
-        t0 = objs["_source"]["timestamp_ms"]
-
-    t1 = 0
-    with request.urlopen(url1) as f:
-        data = f.read()
-        objs = json.loads(data)
-        t1 = objs["_source"]["timestamp_ms"]
-
-    return t1 - t0
+def cached_range_stats(cache, ranges):
+    """
+    Same as range_stats, computed from the local block cache
+    """
+    stats = dict()
+    for (f, l) in ranges:
+        s = cache.between(f, l)
+        txs = cache.columns["txs"][s]
+        ts = cache.columns["timestamp_ms"][s]
+        ts = ts[ts >= 0]
+        spans = int(ts.max() - ts.min()) if len(ts) > 0 else 0
+        stats[(f, l)] = (float(txs[txs > 0].sum()), spans)
+    return stats
 
 
 def tps(txs, spans):
+    if spans == 0:
+        return 0
     return txs / (spans / 1000)
 
 
@@ -60,33 +75,27 @@ def show(fromnum, lastnum, txs, spans, tps):
     print("|{} - {:<8} | {:<18.0f} | {:<10.2f} | {:<10.2f}|".format(fromnum, lastnum, txs, spans/3600000, tps))
 
 
+def parse_range(s):
+    fromnum, lastnum = s.split("-")
+    return int(fromnum), int(lastnum)
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: %s <url> <index_name>" % (sys.argv[0]))
+        print("Usage: %s <url> <index_name> [<from>-<last> ...]" % (sys.argv[0]))
         sys.exit(0)
 
-    print("|{:<14} | {:<18} | {:<10} | {:<10}|".format("Range", "Transactions", "Span", "TPS"))
-
-    url = sys.argv[1]
+    client = Client(sys.argv[1])
     index_name = sys.argv[2]
-    show(
-        501,
-        10501,
-        txs_count(url, index_name, 501, 10501),
-        span_time(url, index_name, 501, 10501),
-        tps(txs_count(url, index_name, 501, 10501), span_time(url, index_name, 501, 10501)),
-    )
-    show(
-        501,
-        20501,
-        txs_count(url, index_name, 501, 20501),
-        span_time(url, index_name, 501, 20501),
-        tps(txs_count(url, index_name, 501, 20501), span_time(url, index_name, 501, 20501)),
-    )
-    show(
-        501,
-        30501,
-        txs_count(url, index_name, 501, 30501),
-        span_time(url, index_name, 501, 30501),
-        tps(txs_count(url, index_name, 501, 30501), span_time(url, index_name, 501, 30501)),
-    )
+    ranges = [parse_range(s) for s in sys.argv[3:]] or default_ranges
+
+    cache = open_cache(client, sys.argv[1], index_name)
+    if cache:
+        stats = cached_range_stats(cache, ranges)
+    else:
+        stats = range_stats(client, index_name, ranges)
+
+    print("|{:<14} | {:<18} | {:<10} | {:<10}|".format("Range", "Transactions", "Span", "TPS"))
+    for (fromnum, lastnum) in ranges:
+        txs, spans = stats[(fromnum, lastnum)]
+        show(fromnum, lastnum, txs, spans, tps(txs, spans))
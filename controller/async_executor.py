@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+#
+
+"""
+asyncio ssh execution engine shared by the controllers
+
+pip3 install asyncssh
+
+Every node's perform coroutine runs under a global concurrency limit and a
+per-host limit, nodes on the same host share one ssh connection. The limits
+default to the CONTROLLER_CONCURRENCY and CONTROLLER_PER_HOST environment
+variables. Files are transferred as one gzip tar stream, or zstd with
+CONTROLLER_COMPRESS=zstd (requires `pip3 install zstandard` here and zstd on
+the hosts).
+
+A node's perform is retried CONTROLLER_RETRIES times after a transient ssh
+failure (connection lost or refused), and cancelled after
+CONTROLLER_TASK_TIMEOUT seconds. Nodes still running CONTROLLER_TIMEOUT
+seconds after the start are cancelled too, 0 disables a timeout.
+
+Example:
+async def perform(ex, node):
+    return await ex.sudo(node, "docker ps")
+
+results = execute(nodes, perform, "ps")
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import shlex
+import tarfile
+import time
+
+import asyncssh
+
+CONCURRENCY = int(os.environ.get("CONTROLLER_CONCURRENCY", 100))
+PER_HOST = int(os.environ.get("CONTROLLER_PER_HOST", 8))
+COMPRESS = os.environ.get("CONTROLLER_COMPRESS", "gzip")
+RETRIES = int(os.environ.get("CONTROLLER_RETRIES", 2))
+TASK_TIMEOUT = float(os.environ.get("CONTROLLER_TASK_TIMEOUT", 0))
+TIMEOUT = float(os.environ.get("CONTROLLER_TIMEOUT", 0))
+# seconds between the notes listing the nodes still running
+PROGRESS = 10
+
+TRANSIENT = (ConnectionError, asyncssh.DisconnectError, asyncssh.ChannelOpenError)
+
+
+class RemoteError(Exception):
+    pass
+
+
+def sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _Pipe:
+    """
+    Write end of a tar stream built in a worker thread, handing the
+    (compressed) bytes chunk by chunk to the event loop through a bounded
+    queue, so at most a few chunks of a large file are held in memory
+    """
+
+    def __init__(self, loop, compressor=None, depth=16):
+        self.loop = loop
+        self.compressor = compressor
+        self.queue = asyncio.Queue(depth)
+        self.aborted = False
+
+    def _put(self, data):
+        if self.aborted:
+            raise RemoteError("transfer aborted")
+        asyncio.run_coroutine_threadsafe(self.queue.put(data), self.loop).result()
+
+    def write(self, data):
+        n = len(data)
+        if self.compressor:
+            data = self.compressor.compress(data)
+        if data:
+            self._put(bytes(data))
+        return n
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        if self.compressor:
+            self._put(self.compressor.flush())
+
+    def end(self):
+        """
+        Tell the reader the stream is over, complete or not
+        """
+        if not self.aborted:
+            self._put(None)
+
+    def abort(self):
+        """
+        Stop the worker, it may be blocked on a full queue
+        """
+        self.aborted = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+def _tar_mode():
+    """
+    :return: tarfile mode, compressor and the remote extract command
+    """
+    if COMPRESS == "zstd":
+        import zstandard
+        return "w|", zstandard.ZstdCompressor().compressobj(), "zstd -dc | tar -xf -"
+    return "w|gz", None, "tar -xzf -"
+
+
+class AsyncExecutor:
+    def __init__(self, limit=CONCURRENCY, per_host=PER_HOST, retries=RETRIES,
+                 task_timeout=TASK_TIMEOUT, timeout=TIMEOUT):
+        self.limit = limit
+        self.per_host = per_host
+        self.retries = retries
+        self.task_timeout = task_timeout
+        self.timeout = timeout
+        self.conns = dict()
+        self.stale = []
+        self.host_sems = dict()
+        self.onces = dict()
+        self.sem = None
+
+    async def connection(self, node):
+        """
+        The ssh connection of the node's host, opened on first use
+        """
+        key = (node["host"], int(node.get("port", 22)), node["user"])
+        conn = self.conns.get(key)
+        if conn is None:
+            conn = asyncio.ensure_future(asyncssh.connect(
+                key[0], port=key[1], username=key[2], password=node["passwd"], known_hosts=None))
+            self.conns[key] = conn
+        return await conn
+
+    async def run(self, node, cmd, sudo=False, check=False):
+        """
+        Run cmd in a shell on the node's host
+        :param sudo: run it as root, the password is written to sudo's stdin
+        :param check: raise RemoteError on a non-zero exit status
+        :return: stdout
+        """
+        conn = await self.connection(node)
+        stdin = None
+        if sudo:
+            stdin = node["passwd"] + "\n"
+            cmd = "sudo -S -p '' bash -c " + shlex.quote(cmd)
+        r = await conn.run(cmd, input=stdin)
+        if check and r.exit_status != 0:
+            raise RemoteError("exit status {}: {}".format(r.exit_status, r.stderr.strip()))
+        return r.stdout
+
+    async def sudo(self, node, cmd, check=False):
+        return await self.run(node, cmd, True, check)
+
+    async def script(self, node, cmds, check=False):
+        """
+        Run several commands in one root shell
+        :param check: stop at the first failing command and raise RemoteError
+        """
+        if check:
+            cmds = ["set -e"] + cmds
+        return await self.run(node, "\n".join(cmds), True, check)
+
+    async def put(self, node, local, remote, recurse=False):
+        conn = await self.connection(node)
+        await asyncssh.scp(local, (conn, remote), recurse=recurse)
+
+    async def put_tar(self, node, files, remote_dir, delta=False, base=None):
+        """
+        Stream files as one compressed tarball over a single channel into
+        tar -x under remote_dir. The tarball is unpacked aside first, so an
+        interrupted transfer leaves no partial files in remote_dir
+        :param files: dict of relative path -> local path
+        :param delta: skip the files whose sha256 already matches base
+        :param base: the directory delta compares against, remote_dir by default
+        :return: number of files sent
+        """
+        target = shlex.quote(remote_dir)
+        if delta:
+            rels = " ".join(shlex.quote(rel) for rel in sorted(files))
+            # only the files to send are hashed, and as root as base may be
+            # the deployed tree
+            out = await self.sudo(node, "cd %s 2>/dev/null && sha256sum -- %s 2>/dev/null" % (
+                shlex.quote(base or remote_dir), rels))
+            remote = dict()
+            for line in out.splitlines():
+                h, _, rel = line.partition("  ")
+                remote[rel] = h
+            files = {rel: local for rel, local in files.items() if remote.get(rel) != sha256(local)}
+        if not files:
+            return 0
+
+        mode, compressor, extract = _tar_mode()
+        script = "\n".join([
+            "set -e -o pipefail",
+            "mkdir -p %s" % (target),
+            "d=$(mktemp -d %s/.incoming.XXXXXX)" % (target),
+            "trap 'rm -rf \"$d\"' EXIT",
+            '%s -C "$d"' % (extract),
+            'cp -alf "$d"/. %s/' % (target),
+        ])
+        conn = await self.connection(node)
+        proc = await conn.create_process("bash -c " + shlex.quote(script), encoding=None)
+        pipe = _Pipe(asyncio.get_event_loop(), compressor)
+
+        def build():
+            try:
+                with tarfile.open(fileobj=pipe, mode=mode, dereference=True) as tar:
+                    for rel, local in sorted(files.items()):
+                        tar.add(local, arcname=rel)
+                pipe.finish()
+            finally:
+                pipe.end()
+
+        builder = asyncio.get_event_loop().run_in_executor(None, build)
+        # the worker fails too when the transfer is aborted, that error is not the cause
+        builder.add_done_callback(lambda f: f.cancelled() or f.exception())
+        lost = None
+        try:
+            while True:
+                chunk = await pipe.queue.get()
+                if chunk is None:
+                    break
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+            await builder
+            proc.stdin.write_eof()
+        except ConnectionError as e:
+            # the extract may have exited early, its status tells why
+            lost = e
+        finally:
+            pipe.abort()
+        r = await proc.wait()
+        if r.exit_status != 0:
+            raise RemoteError("extract exit status {}: {}".format(r.exit_status, r.stderr.decode().strip()))
+        if lost:
+            raise lost
+        return len(files)
+
+    async def once(self, node, key, perform):
+        """
+        Await perform() only once per host and key, the other nodes of the
+        host wait for and share its result. A failed perform is forgotten, so
+        a retry runs it again
+        """
+        k = (node["host"], key)
+        fut = self.onces.get(k)
+        if fut is None:
+            fut = self.onces[k] = asyncio.ensure_future(perform())
+        try:
+            # a waiter cancelled by its timeout leaves the shared perform running
+            return await asyncio.shield(fut)
+        except Exception:
+            if fut.done() and self.onces.get(k) is fut:
+                del self.onces[k]
+            raise
+
+    def _drop(self, node):
+        """
+        Forget the node's host connection so the next use reconnects
+        """
+        key = (node["host"], int(node.get("port", 22)), node["user"])
+        conn = self.conns.get(key)
+        if conn is not None and conn.done():
+            self.stale.append(self.conns.pop(key))
+
+    async def _perform(self, i, node, perform):
+        host_sem = self.host_sems.get(node["host"])
+        if host_sem is None:
+            host_sem = self.host_sems[node["host"]] = asyncio.Semaphore(self.per_host)
+        async with self.sem, host_sem:
+            begin = time.time()
+            attempts = 0
+            while True:
+                attempts = attempts + 1
+                try:
+                    if self.task_timeout:
+                        result = await asyncio.wait_for(perform(self, node), self.task_timeout)
+                    else:
+                        result = await perform(self, node)
+                    return i, result, None, time.time() - begin, attempts
+                except asyncio.TimeoutError:
+                    e = RemoteError("timeout after {}s".format(self.task_timeout))
+                    return i, None, e, time.time() - begin, attempts
+                except TRANSIENT as e:
+                    if attempts > self.retries:
+                        return i, None, e, time.time() - begin, attempts
+                    # a refused session is not a lost connection
+                    if not isinstance(e, asyncssh.ChannelOpenError):
+                        self._drop(node)
+                    await asyncio.sleep(attempts)
+                except Exception as e:
+                    return i, None, e, time.time() - begin, attempts
+
+    async def _execute(self, nodes, perform, name, report, summary):
+        self.sem = asyncio.Semaphore(self.limit)
+        results = [None] * len(nodes)
+        stats = [None] * len(nodes)
+        begin = time.time()
+        tasks = {asyncio.ensure_future(self._perform(i, node, perform)): i for i, node in enumerate(nodes)}
+        pending = set(tasks)
+        try:
+            noted = begin
+            while pending:
+                wait = PROGRESS
+                if self.timeout:
+                    wait = min(wait, begin + self.timeout - time.time())
+                    if wait <= 0:
+                        break
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    i, result, e, elapsed, attempts = f.result()
+                    node = nodes[i]
+                    if e:
+                        print("{} {}@{:<10} result: exception<{}>".format(name, node["name"], node["host"], e))
+                    elif report:
+                        print("{} {}@{:<10} result: success ({:.1f}s)".format(name, node["name"], node["host"], elapsed))
+                    results[i] = (result, e)
+                    stats[i] = (elapsed, attempts)
+                if pending and time.time() - noted >= PROGRESS:
+                    noted = time.time()
+                    waiting = ["{}@{}".format(nodes[tasks[f]]["name"], nodes[tasks[f]]["host"]) for f in pending]
+                    print("{} waiting for {} nodes ({:.0f}s): {}".format(
+                        name, len(waiting), noted - begin, " ".join(sorted(waiting)[:10])))
+            for f in pending:
+                f.cancel()
+                i = tasks[f]
+                e = RemoteError("timeout after {}s".format(self.timeout))
+                print("{} {}@{:<10} result: exception<{}>".format(name, nodes[i]["name"], nodes[i]["host"], e))
+                results[i] = (None, e)
+                stats[i] = (time.time() - begin, 0)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            await self.close()
+
+        if summary:
+            write_summary(summary, name, nodes, results, stats, begin)
+        return results
+
+    def execute(self, nodes, perform, name, report=True, summary=None):
+        """
+        Run perform(executor, node) for every node, reporting each node as
+        soon as it finishes
+        :param summary: path of a json summary of the run
+        :return: list of (result, exception) in the order of nodes
+        """
+        return asyncio.run(self._execute(nodes, perform, name, report, summary))
+
+    async def close(self):
+        for conn in list(self.conns.values()) + self.stale:
+            if conn.done() and not conn.cancelled() and conn.exception() is None:
+                conn.result().close()
+                await conn.result().wait_closed()
+            else:
+                conn.cancel()
+        self.conns.clear()
+        self.stale = []
+        self.host_sems.clear()
+        self.onces.clear()
+
+
+def write_summary(path, name, nodes, results, stats, begin):
+    items = []
+    for node, (result, e), (elapsed, attempts) in zip(nodes, results, stats):
+        items.append({
+            "name": node["name"],
+            "host": node["host"],
+            "ok": e is None,
+            "error": None if e is None else str(e),
+            "elapsed": round(elapsed, 3),
+            "attempts": attempts,
+        })
+    doc = {
+        "name": name,
+        "start": begin,
+        "elapsed": round(time.time() - begin, 3),
+        "ok": len([i for i in items if i["ok"]]),
+        "failed": len([i for i in items if not i["ok"]]),
+        "nodes": items,
+    }
+    with open(path, "w") as fp:
+        json.dump(doc, fp, indent=2)
+
+
+def execute(nodes, perform, name, report=True, summary=None):
+    return AsyncExecutor().execute(nodes, perform, name, report, summary)
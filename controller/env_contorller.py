@@ -5,12 +5,18 @@ pip3 install paramiko
 pip3 install futures
 pip3 install scp
 pip3 install ruamel.yaml
+pip3 install asyncssh
 """
 
+import atexit
+import contextlib
+import http.client
 import json
 import os
-import shutil
+import posixpath
+import shlex
 import sys
+import threading
 import time
 from concurrent import futures
 
@@ -18,6 +24,10 @@ import paramiko
 from ruamel.yaml import YAML
 from scp import SCPClient
 
+from async_executor import execute, sha256
+from gen_config import apply_keys, load_keys, read_key_files, save_keys, write_key_files
+from platon_rpc import Cluster, HTTPClient, RPCError, rpc_address, to_int
+
 # import config_docker as config
 need_point = False
 if sys.platform == "linux":
@@ -27,25 +37,65 @@ else:
     PLATON_BIN = os.path.abspath("./bin/platon.exe")
 
 
+# sshd limits concurrent sessions per connection (MaxSessions, 10 by default)
+MAX_SESSIONS = 8
+
+
+class SSHPool:
+    """
+    One ssh connection per (host, port, user), shared by every node on that
+    host and reused by every command of one invocation
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.host_locks = dict()
+        self.conns = dict()
+
+    def get(self, node):
+        key = (node["host"], int(node["port"]), node["user"])
+        with self.lock:
+            host_lock = self.host_locks.setdefault(key, threading.Lock())
+        with host_lock:
+            ssh = self.conns.get(key)
+            transport = ssh.get_transport() if ssh else None
+            if transport is None or not transport.is_active():
+                ssh = paramiko.SSHClient()
+                ssh.load_system_host_keys()
+                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                ssh.connect(node["host"], node["port"], node["user"], node["passwd"])
+                ssh.sessions = threading.BoundedSemaphore(MAX_SESSIONS)
+                self.conns[key] = ssh
+            return ssh
+
+    def close(self):
+        with self.lock:
+            for ssh in self.conns.values():
+                ssh.close()
+            self.conns.clear()
+
+
+pool = SSHPool()
+atexit.register(pool.close)
+
+
 def connect(node):
-    try:
-        ssh = paramiko.SSHClient()
-        ssh.load_system_host_keys()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(node["host"], node["port"], node["user"], node["passwd"])
-        return ssh
-    except Exception as e:
-        raise e
+    return pool.get(node)
+
+
+def _session(ssh):
+    return getattr(ssh, "sessions", None) or contextlib.suppress()
 
 
 def exec_cmd(ssh, cmd, passwd=None):
     try:
         print(cmd)
-        stdin, stdout, stderr = ssh.exec_command(cmd)
-        if passwd:
-            stdin.write(passwd + "\n")
-        for line in stdout.readlines():
-            print(line)
+        with _session(ssh):
+            stdin, stdout, stderr = ssh.exec_command(cmd)
+            if passwd:
+                stdin.write(passwd + "\n")
+            for line in stdout.readlines():
+                print(line)
     except Exception as e:
         print("exec {} expect: {}".format(cmd, e))
         return
@@ -53,38 +103,51 @@ def exec_cmd(ssh, cmd, passwd=None):
 
 def exec_cmd_return(ssh, cmd, passwd):
     try:
-        stdin, stdout, stderr = ssh.exec_command(cmd)
-        if passwd:
-            stdin.write(passwd + "\n")
-        lines = []
-        for line in stdout.readlines():
-            lines.append(line)
-        for line in stderr.readlines():
-            lines.append(line)
-        return lines
+        with _session(ssh):
+            stdin, stdout, stderr = ssh.exec_command(cmd)
+            if passwd:
+                stdin.write(passwd + "\n")
+            lines = []
+            for line in stdout.readlines():
+                lines.append(line)
+            for line in stderr.readlines():
+                lines.append(line)
+            return lines
     except Exception as e:
         print("exec {} expect: {}".format(cmd, e))
         return []
 
 
+def exec_script(ssh, cmds, passwd=None):
+    """
+    Run several commands in one remote shell, as root when passwd is given
+    """
+    script = shlex.quote("\n".join(cmds))
+    if passwd:
+        exec_cmd(ssh, "sudo -S -p '' bash -c " + script, passwd)
+    else:
+        exec_cmd(ssh, "bash -c " + script)
+
+
 def upload_via_scp(ssh, local, remote):
-    scp = SCPClient(ssh.get_transport())
-    scp.put(local, recursive=True, remote_path=remote)
-    scp.close()
+    with _session(ssh):
+        scp = SCPClient(ssh.get_transport())
+        scp.put(local, recursive=True, remote_path=remote)
+        scp.close()
 
 
 def get_via_scp(ssh, remote, local):
-    scp = SCPClient(ssh.get_transport())
-    scp.get(remote, local)
-    scp.close()
+    with _session(ssh):
+        scp = SCPClient(ssh.get_transport())
+        scp.get(remote, local)
+        scp.close()
 
 
 def upload(ssh, file, dst):
-    sftp = paramiko.SFTPClient.from_transport(ssh.get_transport())
-    sftp = ssh.open_sftp()
-
-    sftp.put(file, dst)
-    sftp.close()
+    with _session(ssh):
+        sftp = ssh.open_sftp()
+        sftp.put(file, dst)
+        sftp.close()
 
 
 def deploy_docker_and_docker_compose(nodes):
@@ -102,10 +165,10 @@ def deploy_docker_and_docker_compose(nodes):
         upload_via_scp(ssh, "./script/docker-install.sh",
                        "/tmp/docker-install.sh")
         # upload_via_scp(ssh, "./script/docker-compose", "/tmp/docker-compose")
-        exec_cmd(ssh, "sudo -S -p '' bash /tmp/docker-install.sh",
-                 node["passwd"])
-        exec_cmd(
-            ssh, "sudo -S -p '' gpasswd -a ${USER} docker", node["passwd"])
+        exec_script(ssh, [
+            "bash /tmp/docker-install.sh",
+            "gpasswd -a %s docker" % (node["user"]),
+        ], node["passwd"])
     with futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
         for node in deploy_node:
             executor.submit(perform, node)
@@ -123,66 +186,54 @@ def run(cmd):
     return out
 
 
+def _gen_keys(keytool):
+    """
+    Generate the node key pair and the bls key pair of one node, runs in a
+    worker process
+    """
+    keypair = json.loads(run("{} genkeypair --json".format(keytool)))
+    blskeypair = json.loads(run("{} genblskeypair --json".format(keytool)))
+    return {
+        "nodekey": keypair["PrivateKey"],
+        "pubkey": keypair["PublicKey"],
+        "address": keypair["Address"],
+        "blskey": blskeypair["PrivateKey"],
+        "blspub": blskeypair["PublicKey"],
+    }
+
+
 def ethkey_gen(nodes):
     if sys.platform == "linux":
         keytool = os.path.abspath("./bin/keytool")
     else:
         keytool = os.path.abspath("./bin/keytool.exe")
 
-    def gen(node):
-        path = "./deploy-docker/" + node["name"] + "/data"
-        try:
-            os.makedirs(path, 0o755)
-        except os.error:
-            pass
-
-        if len(os.listdir(path)) > 0:
-            print("node(%s) already gen key" % (node["name"]))
-            with open("{}/{}/data/blskey".format("./deploy-docker", node["name"])) as f:
-                node["blskey"] = f.read()
-            with open("{}/{}/data/blspub".format("./deploy-docker", node["name"])) as f:
-                node["blspub"] = f.read()
-            with open("{}/{}/data/nodekey".format("./deploy-docker", node["name"])) as f:
-                node["nodekey"] = f.read()
-            with open("{}/{}/data/pub".format("./deploy-docker", node["name"])) as f:
-                node["pubkey"] = f.read()
-            return
-
-        keypair = run("{} genkeypair".format(keytool))
-        lines = keypair.split("\n")
-        for l in lines:
-            kv = l.split(":")
-            if kv[0] == "PrivateKey":
-                key = kv[1].strip()
-                fp = open(path + "/nodekey", "w")
-                fp.write(key)
-                fp.close()
-                node["nodekey"] = key
-            elif kv[0] == "PublicKey ":
-                key = kv[1].strip()
-                fp = open(path + "/pub", "w")
-                fp.write(key)
-                fp.close()
-                node["pubkey"] = key
-            elif "Address" in kv[0]:
-                key = kv[1].strip()
-                fp = open(path + "/addr", "w")
-                fp.write(key)
-                fp.close()
-
-        keypair = run("{} genblskeypair --json".format(keytool))
-        objs = json.loads(keypair)
-        fp = open("{}/blskey".format(path), "w")
-        fp.write(objs["PrivateKey"])
-        fp.close()
-        fp = open("{}/blspub".format(path), "w")
-        fp.write(objs["PublicKey"])
-        fp.close()
-        node["blskey"] = objs["PrivateKey"]
-        node["blspub"] = objs["PublicKey"]
+    keys = load_keys()
+    known = len(keys)
+    missing = []
+    for node in nodes:
+        if node["name"] not in keys:
+            old = read_key_files(node["name"])
+            if old is None:
+                missing.append(node["name"])
+                continue
+            keys[node["name"]] = old
+        print("node(%s) already gen key" % (node["name"]))
+
+    if missing:
+        # the workers mostly wait on keytool, so run more of them than cpus
+        workers = min(len(missing), 4 * (os.cpu_count() or 1))
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for name, k in zip(missing, executor.map(_gen_keys, [keytool] * len(missing))):
+                keys[name] = k
+    if len(keys) != known:
+        save_keys(keys)
 
     for node in nodes:
-        gen(node)
+        k = keys[node["name"]]
+        if node["name"] in missing or not os.path.isfile("./deploy-docker/%s/data/nodekey" % (node["name"])):
+            write_key_files(node["name"], k)
+        apply_keys(node, k)
 
 
 def gen_fluent_config(node):
@@ -501,71 +552,96 @@ def gen_genesis(nodes, gstmpl, tag, program_version):
     validators_file.close()
 
 
+def node_files(node, shared):
+    """
+    Files to deploy for the node: its ./deploy-docker/<name> tree plus the
+    shared files
+    :param shared: dict of relative path -> local path
+    :return: dict of relative path -> local path
+    """
+    root = "./deploy-docker/" + node["name"]
+    files = dict()
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            local = os.path.join(dirpath, name)
+            files[os.path.relpath(local, root).replace(os.sep, "/")] = local
+    files.update(shared)
+    return files
+
+
 def deploy_platon(nodes, tag, program_version):
     ethkey_gen(nodes)
     gen_genesis(nodes, "./tmpl/genesis.json", tag, program_version)
 
-    def perform(node):
-        path = "./deploy-docker/" + node["name"]
-        shutil.copyfile("./deploy-docker/genesis.json", path + "/genesis.json")
-        if os.path.isfile("./deploy-docker/static-nodes.json"):
-            shutil.copyfile("./deploy-docker/static-nodes.json",
-                            path + "/data/static-nodes.json")
-        shutil.copyfile("shell/platon-log-cron.sh",
-                        path + "/platon-log-cron.sh")
-
-        ssh = connect(node)
-        exec_cmd(ssh, "sudo -S -p '' rm -rf " +
-                 node["path"] + "/data", node["passwd"])
-        exec_cmd(ssh, "sudo -S -p '' mkdir -p " + node["path"], node["passwd"])
-        exec_cmd(ssh, "sudo -S -p '' mkdir -p " +
-                 node["path"] + "/log", node["passwd"])
-        exec_cmd(ssh, "sudo -S -p '' chmod 777 %s/log" %
-                 (node["path"]), node["passwd"])
-
-        exec_cmd(ssh, "rm -rf /tmp/" + node["name"])
-        upload_via_scp(ssh, local="./deploy-docker/" +
-                       node["name"], remote="/tmp/" + node["name"])
-
-        # copy files
-        exec_cmd(ssh, "cd /tmp/" +
-                 node["name"] + " && sudo -S -p '' cp -r * " + node["path"], node["passwd"],)
-        exec_cmd(
-            ssh, "sudo -S -p '' docker pull {}:{}".format(node["registry"], "loader"), node["passwd"],)
-        exec_cmd(
-            ssh, "sudo -S -p '' docker pull {}:{}".format(node["registry"], tag), node["passwd"],)
-        exec_cmd(ssh, "cd %s && sudo -S -p '' docker-compose up -d" %
-                 (node["path"]), node["passwd"],)
-
-        # logrotate
-        exec_cmd(ssh, "sudo -S -p '' cp %s/%s.conf /etc/logrotate.d" %
-                 (node["path"], node["name"]), node["passwd"],)
-        exec_cmd(ssh, "sudo -S -p '' bash %s/platon-log-cron.sh %s" %
-                 (node["path"], node["name"]), node["passwd"],)
-        exec_cmd(ssh, "sudo -S -p service cron restart", node["passwd"])
-
-    with futures.ThreadPoolExecutor(max_workers=10) as executor:
-        fs = []
-        for node in nodes:
-            fs.append((executor.submit(perform, node),
-                       (node["name"], node["host"])))
+    shared = {
+        "genesis.json": "./deploy-docker/genesis.json",
+        "platon-log-cron.sh": "shell/platon-log-cron.sh",
+    }
+    if os.path.isfile("./deploy-docker/static-nodes.json"):
+        shared["data/static-nodes.json"] = "./deploy-docker/static-nodes.json"
 
-        for (f, n) in fs:
-            e = f.exception()
-            if e:
-                print("deploy {}@{} exception: {}".format(n[0], n[1], e))
-            else:
-                print("deploy {}@{} success".format(n[0], n[1]))
+    # content address every file, each distinct blob goes once to every host
+    files = dict()
+    digests = dict()
+    host_blobs = dict()
+    for node in nodes:
+        files[node["name"]] = node_files(node, shared)
+        blobs = host_blobs.setdefault(node["host"], dict())
+        for local in files[node["name"]].values():
+            if local not in digests:
+                digests[local] = sha256(local)
+            blobs[digests[local]] = local
+
+    async def upload_blobs(ex, node):
+        """
+        :return: the blob dir, private to the ssh user as it holds the keys
+        """
+        out = await ex.run(node, " && ".join([
+            "mkdir -p -m 700 ~/.cache/platon-blobs",
+            "chmod 700 ~/.cache/platon-blobs",
+            "cd ~/.cache/platon-blobs",
+            "pwd",
+            "ls",
+        ]), check=True)
+        lines = out.split()
+        blob_dir, have = lines[0], set(lines[1:])
+        missing = {h: local for h, local in host_blobs[node["host"]].items() if h not in have}
+        await ex.put_tar(node, missing, blob_dir)
+        return blob_dir
+
+    async def remote(ex, node):
+        blob_dir = await ex.once(node, ("blobs", node["user"]), lambda: upload_blobs(ex, node))
+        for image in ("{}:{}".format(node["registry"], "loader"), "{}:{}".format(node["registry"], tag)):
+            await ex.once(node, ("pull", image), lambda: ex.sudo(node, "docker pull " + image, check=True))
+
+        node_path = node["path"]
+        cmds = [
+            "rm -rf %s/data" % (node_path),
+            "mkdir -p %s/log" % (node_path),
+            "chmod 777 %s/log" % (node_path),
+        ]
+        dirs = set(posixpath.dirname(rel) for rel in files[node["name"]]) - {""}
+        cmds += ["mkdir -p %s/%s" % (node_path, d) for d in sorted(dirs)]
+        # materialize the node directory from the blobs, copied so every
+        # node owns its files (as root) instead of sharing the blob's inode
+        for rel, local in sorted(files[node["name"]].items()):
+            cmds.append("cp {0}/{1} {2}/{3}".format(shlex.quote(blob_dir), digests[local], node_path, rel))
+        cmds += [
+            "(cd %s && docker-compose up -d)" % (node_path),
+            # logrotate
+            "cp %s/%s.conf /etc/logrotate.d" % (node_path, node["name"]),
+            "bash %s/platon-log-cron.sh %s" % (node_path, node["name"]),
+            "service cron restart",
+        ]
+        await ex.script(node, cmds, check=True)
+
+    execute(nodes, remote, "deploy")
 
 
 def check(nodes):
-    def perform(node):
-        ssh = connect(node)
-        lines = exec_cmd_return(
-            ssh,
-            "cd %s && sudo -S -p '' docker-compose ps" % (node["path"]),
-            node["passwd"],
-        )
+    async def perform(ex, node):
+        out = await ex.sudo(node, "cd %s && docker-compose ps 2>&1" % (node["path"]))
+        lines = out.splitlines()
         status = "Not Exist"
         printed = False
         for line in lines:
@@ -588,9 +664,7 @@ def check(nodes):
             print("%s@%s                \t%s" %
                   (node["name"], node["host"], status))
 
-    with futures.ThreadPoolExecutor(max_workers=10) as executor:
-        for node in nodes:
-            executor.submit(perform, node)
+    execute(nodes, perform, "check", report=False)
 
 
 def deploy(config_file, program_version, tag="latest"):
@@ -618,14 +692,10 @@ def start(config_file):
     nodes = json.load(fp)
     fp.close()
 
-    def perform(node):
-        ssh = connect(node)
-        exec_cmd(ssh, "cd %s && sudo -S -p '' docker-compose start" %
-                 (node["path"]), node["passwd"],)
+    async def perform(ex, node):
+        await ex.sudo(node, "cd %s && docker-compose start" % (node["path"]), check=True)
 
-    with futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
-        for node in nodes:
-            executor.submit(perform, node)
+    execute(nodes, perform, "start")
 
     check(nodes)
 
@@ -635,14 +705,10 @@ def stop(config_file):
     nodes = json.load(fp)
     fp.close()
 
-    def perform(node):
-        ssh = connect(node)
-        exec_cmd(ssh, "cd %s && sudo -S -p '' docker-compose stop " %
-                 (node["path"]), node["passwd"],)
+    async def perform(ex, node):
+        await ex.sudo(node, "cd %s && docker-compose stop" % (node["path"]), check=True)
 
-    with futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
-        for node in nodes:
-            executor.submit(perform, node)
+    execute(nodes, perform, "stop")
 
     check(nodes)
 
@@ -652,17 +718,15 @@ def remove(config_file):
     nodes = json.load(fp)
     fp.close()
 
-    def perform(node):
-        ssh = connect(node)
-        exec_cmd(ssh, "cd %s && sudo -S -p '' docker-compose down" %
-                 (node["path"]), node["passwd"],)
-        exec_cmd(ssh, "sudo -S -p '' rm -rf " + node["path"], node["passwd"])
+    async def perform(ex, node):
+        await ex.script(node, [
+            # a missing or half deployed node is removed all the same
+            "[ -d {0} ] && (cd {0} && docker-compose down) || true".format(node["path"]),
+            "rm -rf " + node["path"],
+        ], check=True)
         # exec_cmd(ssh, "sudo -S -p '' cp /etc/crontab.bak /etc/crontab", node["passwd"])
 
-    with futures.ThreadPoolExecutor(max_workers=20) as executor:
-        for node in nodes:
-            print("remove %s" % (node["name"]))
-            executor.submit(perform, node)
+    execute(nodes, perform, "remove")
 
 
 def status(config_file):
@@ -676,70 +740,101 @@ def update(config_file, tag):
     nodes = json.load(fp)
     fp.close()
 
-    def perform(node):
-        ssh = connect(node)
+    for node in nodes:
         update_docker_compose_config(node, tag)
-        # backup
-        exec_cmd(ssh, "sudo -S -p '' mv " + node["path"] + "/docker-compose.yaml " + node["path"] + "/docker-compose.yaml.bak",
-                 node["passwd"],
-                 )
-        # upload platon
-        upload(ssh, "./deploy-docker/%s/docker-compose.yaml" %
-               (node["name"]), "/tmp/%s-docker-compose.yaml" % (node["name"]),)
-        # replace
-        exec_cmd(ssh,  "sudo -S -p '' cp /tmp/%s-docker-compose.yaml %s/docker-compose.yaml" %
-                 (node["name"], node["path"]), node["passwd"],)
-        exec_cmd(
-            ssh, "sudo -S -p '' docker pull {}:{}".format(node["registry"], tag), node["passwd"],)
+
+    async def perform(ex, node):
+        image = "{}:{}".format(node["registry"], tag)
+        await ex.once(node, ("pull", image), lambda: ex.sudo(node, "docker pull " + image, check=True))
+        # upload the compose file unless the deployed one is the same
+        stage = "/tmp/%s-update" % (node["name"])
+        cmds = []
+        if await ex.put_tar(node, {"docker-compose.yaml": "./deploy-docker/%s/docker-compose.yaml" % (node["name"])},
+                            stage, delta=True, base=node["path"]):
+            cmds += [
+                # backup
+                "mv %s/docker-compose.yaml %s/docker-compose.yaml.bak" % (node["path"], node["path"]),
+                # replace
+                "cp %s/docker-compose.yaml %s/docker-compose.yaml" % (stage, node["path"]),
+            ]
         # update
-        exec_cmd(ssh, "cd %s && sudo -S -p '' docker-compose up -d --force-recreate" %
-                 (node["path"]), node["passwd"],)
+        cmds.append("(cd %s && docker-compose up -d --force-recreate)" % (node["path"]))
+        await ex.script(node, cmds, check=True)
 
-    with futures.ThreadPoolExecutor(max_workers=10) as executor:
-        for node in nodes:
-            print("update %s" % (node["name"]))
-            executor.submit(perform, node)
+    execute(nodes, perform, "update")
 
     check(nodes)
 
 
-def block_number(config_file):
+def _value(v, default="-"):
+    return default if v is None or isinstance(v, Exception) else v
+
+
+def render_heights(nodes, results):
+    numbers = [_value(r["number"], 0) for r, e in results if r]
+    highest = max(numbers or [0])
+    lines = [
+        "|{:<20} | {:<22} | {:<10} | {:<6} | {:<6} | {:<8} | {:<8} | {:<8} | {:<20}|".format(
+            "Node", "Host", "Block", "Lag", "Peers", "Pending", "Queued", "RTT(ms)", "Status"
+        )
+    ]
+    for node, (r, e) in zip(nodes, results):
+        r = r or dict()
+        number = _value(r.get("number"))
+        lines.append(
+            "|{:<20} | {:<22} | {:<10} | {:<6} | {:<6} | {:<8} | {:<8} | {:<8} | {:<20}|".format(
+                node["name"][:20],
+                "{}:{}".format(node["host"], node["rpc_port"]),
+                number,
+                "-" if number == "-" else highest - number,
+                _value(r.get("peers")),
+                _value(r.get("pending")),
+                _value(r.get("queued")),
+                "-" if e else "{:.0f}".format(r["rtt"]),
+                str(e)[:20] if e else "ok",
+            )
+        )
+    # move the cursor home and clear, so the table refreshes in place
+    print("\033[H\033[J" + "\n".join(lines), flush=True)
+
+
+def block_number(config_file, interval=1):
+    """
+    Block height, peers and txpool of every node, refreshed every interval
+    seconds over one keep-alive rpc connection per node
+    :param config_file:
+    :param interval:
+    :return:
+    """
     fp = open(config_file)
     nodes = json.load(fp)
     fp.close()
+    interval = float(interval)
 
-    def get_block_number(nodes):
-        for node in nodes:
-            try:
-                if not need_point:
-                    cmd = "%s attach ws://%s:%s --exec platon.blockNumber" % (
-                        PLATON_BIN,
-                        node["host"],
-                        node["ws_port"],
-                    )
-                else:
-                    cmd = "%s attach ws://%s:%s --exec 'platon.blockNumber'" % (
-                        PLATON_BIN,
-                        node["host"],
-                        node["ws_port"],
-                    )
-                bn = run(cmd)
-                print(
-                    "node: {:<0}@{:<30} blockNumber: {:<0}".format(
-                        node["name"], node["host"].strip(), bn.strip()
-                    )
-                )
-            except Exception as e:
-                print(e)
+    calls = [("platon_blockNumber", []), ("net_peerCount", []), ("txpool_status", [])]
+
+    def perform(client, node):
+        begin = time.time()
+        number, peers, pool = client.batch(calls)
+        pool = _value(pool, dict())
+        return {
+            "number": number if isinstance(number, Exception) else to_int(number),
+            "peers": peers if isinstance(peers, Exception) else to_int(peers),
+            "pending": to_int(pool.get("pending")),
+            "queued": to_int(pool.get("queued")),
+            "rtt": (time.time() - begin) * 1000,
+        }
 
+    cluster = Cluster(nodes)
     try:
         while True:
-            # print('---------------------------------------------------------')
-            get_block_number(nodes)
-            print("---------------------------------------------------------")
-            time.sleep(5)
+            begin = time.time()
+            render_heights(nodes, cluster.map(perform, timeout=interval))
+            time.sleep(max(0, interval - (time.time() - begin)))
     except KeyboardInterrupt:
         pass
+    finally:
+        cluster.close()
 
 
 def block_number_r(config_file):
@@ -760,17 +855,18 @@ def block_number_r(config_file):
             )
         )
 
+    executor = futures.ThreadPoolExecutor(max_workers=10)
     try:
         while True:
             # print('---------------------------------------------------------')
-            with futures.ThreadPoolExecutor(max_workers=10) as executor:
-                for node in nodes:
-                    executor.submit(get_block_number, node)
+            list(executor.map(get_block_number, nodes))
             # get_block_number(nodes)
             print("---------------------------------------------------------")
             time.sleep(5)
     except KeyboardInterrupt:
         pass
+    finally:
+        executor.shutdown(wait=False)
 
 
 def net_r(config_file):
@@ -793,43 +889,76 @@ def net_r(config_file):
             executor.submit(get_net, node)
 
 
-def debug(config_file):
+def _flatten(obj, prefix=""):
+    if not isinstance(obj, dict):
+        return {prefix: obj}
+    flat = dict()
+    for k, v in obj.items():
+        flat.update(_flatten(v, "{}.{}".format(prefix, k) if prefix else k))
+    return flat
+
+
+def _diff(old, new):
+    """
+    Changed leaves between two snapshots, path -> [old, new]
+    """
+    old = _flatten(old)
+    new = _flatten(new)
+    return {k: [old.get(k), new.get(k)] for k in sorted(set(old) | set(new)) if old.get(k) != new.get(k)}
+
+
+def debug(config_file, period=None, timeout=5):
+    """
+    Snapshot debug_consensusStatus of every node concurrently into debug.log,
+    one json line per node written as soon as it answers. With period, take a
+    snapshot every period seconds and record only what changed since the
+    node's previous one
+    :param config_file:
+    :param period: seconds between snapshots
+    :param timeout: seconds to wait for the nodes of one snapshot
+    :return:
+    """
     fp = open(config_file)
     nodes = json.load(fp)
     fp.close()
+    timeout = float(timeout)
 
-    def status(nodes):
-        ls = []
-        for node in nodes:
-            # try:
-            if need_point:
-                cmd = "%s attach http://%s:%s --exec 'debug.consensusStatus()'" % (
-                    PLATON_BIN,
-                    node["host"],
-                    node["rpc_port"],
-                )
-            else:
-                cmd = "%s attach http://%s:%s --exec debug.consensusStatus()" % (
-                    PLATON_BIN,
-                    node["host"],
-                    node["rpc_port"],
-                )
-            bn = run(cmd)
-            objs = json.loads(bn.strip())
-            ls.append(
-                {
+    def perform(client, node):
+        status = client.call("debug_consensusStatus")
+        if isinstance(status, str):
+            status = json.loads(status)
+        return status, time.time()
+
+    cluster = Cluster(nodes, timeout)
+    last = dict()
+    fp = open("debug.log", "w")
+    try:
+        while True:
+            begin = time.time()
+            for node, result, e in cluster.as_completed(perform, timeout):
+                record = {
+                    "time": time.time() if e else result[1],
                     "node": "{}:{}".format(node["host"], node["rpc_port"]),
                     "name": node["name"],
-                    "status": json.loads(objs),
                 }
-            )
-            # except:
-            #    print('get debug info fail')
-            #    pass
-        fp = open("debug.log", "w")
-        json.dump(ls, fp, indent=2)
+                if e:
+                    record["error"] = str(e)
+                elif node["name"] in last:
+                    record["diff"] = _diff(last[node["name"]], result[0])
+                else:
+                    record["status"] = result[0]
+                if not e:
+                    last[node["name"]] = result[0]
+                fp.write(json.dumps(record) + "\n")
+                fp.flush()
+            if period is None:
+                break
+            time.sleep(max(0, float(period) - (time.time() - begin)))
+    except KeyboardInterrupt:
+        pass
+    finally:
         fp.close()
-    status(nodes)
+        cluster.close()
 
 
 # def date():
@@ -843,96 +972,74 @@ def debug(config_file):
 #             executor.submit(perform, node)
 
 
-def block_interval(config_file, start_bn):
+def trace_intervals(client, start, report, batch=100, poll=1):
+    """
+    Follow the chain from block start, fetching the headers batch blocks per
+    rpc request, and call report(number, interval, miner) for every block
+    after start
+    """
+    pre_timestamp = None
+    number = start
+    while True:
+        try:
+            head = to_int(client.call("platon_blockNumber"))
+            while number <= head:
+                numbers = list(range(number, min(number + batch, head + 1)))
+                blocks = client.batch([("platon_getBlockByNumber", [hex(n), False]) for n in numbers])
+                for n, block in zip(numbers, blocks):
+                    if isinstance(block, Exception):
+                        print("block: {:<10} error: {}".format(n, block), flush=True)
+                        break
+                    if block is None:
+                        break
+                    timestamp = to_int(block["timestamp"])
+                    if pre_timestamp is not None:
+                        report(n, timestamp - pre_timestamp, block["miner"])
+                    pre_timestamp = timestamp
+                    number = n + 1
+                else:
+                    continue
+                # not available yet, retry on the next poll
+                break
+        except (OSError, http.client.HTTPException, RPCError, ValueError) as e:
+            # a stalled or failed request is retried on the next poll
+            print("block: {:<10} error: {}".format(number, e), flush=True)
+        time.sleep(poll)
+
+
+def block_interval(config_file, start_bn, batch=100):
     fp = open(config_file)
     nodes = json.load(fp)
     fp.close()
     node = nodes[0]
-    map_nodes = dict()
-    for node in nodes:
-        path = "./deploy-docker/{}/data/addr".format(node["name"])
-        fp = open(path)
-        addr = fp.read()
-        fp.close()
 
-        map_nodes[addr.lower()] = node
+    keys = load_keys()
+    map_nodes = dict()
+    for n in nodes:
+        k = keys.get(n["name"]) or read_key_files(n["name"])
+        if k and k.get("address"):
+            map_nodes[k["address"].lower()] = n
 
     fp = open("./long_interval.txt", "w")
 
-    def parse_timestamp(s):
-        for line in s.splitlines():
-            if "timestamp: " in line:
-                line = line.strip("timestamp: ")
-                tm = line.strip(",")
-                return int(tm.strip())
-
-    start = int(start_bn)
-    if not need_point:
-        pre_cmd = "%s attach http://%s:%s --exec platon.getBlock(%d)" % (
-            PLATON_BIN, node["host"], node["rpc_port"], start)
-    else:
-        pre_cmd = "%s attach http://%s:%s --exec 'platon.getBlock(%d)'" % (
-            PLATON_BIN, node["host"], node["rpc_port"], start)
-    pre_block = run(pre_cmd)
-
-    pre_timestamp = parse_timestamp(pre_block)
-
-    start = start + 1
-    while True:
-        try:
-            if not need_point:
-                cmd = "%s --verbosity 0 attach http://%s:%s --exec platon.blockNumber" % (
-                    PLATON_BIN, node["host"], node["rpc_port"])
-            else:
-                cmd = "%s --verbosity 0 attach http://%s:%s --exec 'platon.blockNumber'" % (
-                    PLATON_BIN, node["host"], node["rpc_port"])
-            block_number = run(cmd).strip()
-
-            for i in range(start, int(block_number)):
-                if not need_point:
-                    next_cmd = "%s --verbosity 0 attach http://%s:%s --exec platon.getBlock(%s)" % (
-                        PLATON_BIN, node["host"], node["rpc_port"], i)
-                else:
-                    next_cmd = "%s --verbosity 0 attach http://%s:%s --exec 'platon.getBlock(%s)'" % (
-                        PLATON_BIN, node["host"], node["rpc_port"], i)
-                next_block = run(next_cmd)
-
-                def parse_miner(s):
-                    for line in s.splitlines():
-                        if "miner: " in line:
-                            line = line.strip("miner: ")
-                            line = line.lstrip('"')
-                            line = line.strip(",")
-                            line = line.rstrip('"')
-                            return line.strip()
-
-                try:
-                    next_timestamp = parse_timestamp(next_block)
-                    interval = next_timestamp - pre_timestamp
-                    pre_timestamp = next_timestamp
-                    miner = parse_miner(next_block)
-                    n = map_nodes[miner]
-                    print(
-                        "block: {:<10} interval: {:<10} miner:{:<10}({}:{})".format(
-                            i, interval, n["name"], n["host"], n["rpc_port"]
-                        )
-                    )
-                    if interval > 2000:
-                        fp.write(
-                            "%d block: %s \t interval: %d\n"
-                            % (time.time(), i, interval)
-                        )
-                except Exception as e:
-                    print(e)
-
-            start = int(block_number)
+    def report(number, interval, miner):
+        n = map_nodes.get(miner.lower())
+        if n:
+            miner = "{:<10}({}:{})".format(n["name"], n["host"], n["rpc_port"])
+        print("block: {:<10} interval: {:<10} miner:{}".format(number, interval, miner), flush=True)
+        if interval > 2000:
+            fp.write("%d block: %s \t interval: %d\n" % (time.time(), number, interval))
             fp.flush()
-        except KeyboardInterrupt:
-            fp.close()
-            return
+
+    try:
+        trace_intervals(HTTPClient(rpc_address(node), timeout=10), int(start_bn), report, int(batch))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fp.close()
 
 
-def block_interval_simple(config_file, start_bn):
+def block_interval_simple(config_file, start_bn, batch=100):
     fp = open(config_file)
     nodes = json.load(fp)
     fp.close()
@@ -940,65 +1047,13 @@ def block_interval_simple(config_file, start_bn):
     node = nodes[0]
     print(node)
 
-    def parse_timestamp(s):
-        for line in s.splitlines():
-            if "timestamp: " in line:
-                line = line.strip("timestamp: ")
-                tm = line.strip(",")
-                return int(tm.strip())
-
-    start = int(start_bn)
-    if not need_point:
-        pre_cmd = "%s --verbosity 0 attach http://%s:%s --exec platon.getBlock(%d)" % (
-            PLATON_BIN, node["host"], node["rpc_port"], start)
-    else:
-        pre_cmd = "%s --verbosity 0 attach http://%s:%s --exec 'platon.getBlock(%d)'" % (
-            PLATON_BIN, node["host"], node["rpc_port"], start)
-    pre_block = run(pre_cmd)
-    pre_timestamp = parse_timestamp(pre_block)
-    start = start + 1
-    while True:
-        try:
-            if not need_point:
-                cmd = "%s --verbosity 0 attach http://%s:%s --exec platon.blockNumber" % (
-                    PLATON_BIN, node["host"], node["rpc_port"])
-            else:
-                cmd = "%s --verbosity 0 attach http://%s:%s --exec 'platon.blockNumber'" % (
-                    PLATON_BIN, node["host"], node["rpc_port"])
-
-            block_number = run(cmd).strip()
-
-            for i in range(start, int(block_number)):
-                if not need_point:
-                    next_cmd = "%s --verbosity 0 attach http://%s:%s --exec platon.getBlock(%s)" % (
-                        PLATON_BIN, node["host"], node["rpc_port"], i)
-                else:
-                    next_cmd = "%s --verbosity 0 attach http://%s:%s --exec 'platon.getBlock(%s)'" % (
-                        PLATON_BIN, node["host"], node["rpc_port"], i)
-
-                next_block = run(next_cmd)
-
-                def parse_miner(s):
-                    for line in s.splitlines():
-                        if "miner: " in line:
-                            line = line.strip("miner: ")
-                            line = line.lstrip('"')
-                            line = line.strip(",")
-                            line = line.rstrip('"')
-                            return line.strip()
-
-                try:
-                    next_timestamp = parse_timestamp(next_block)
-                    interval = next_timestamp - pre_timestamp
-                    pre_timestamp = next_timestamp
-                    print("block: {:<10} interval: {:<10}".format(i, interval))
-                except Exception as e:
-                    print(e)
-
-            start = int(block_number)
-            time.sleep(1)
-        except KeyboardInterrupt:
-            return
+    def report(number, interval, miner):
+        print("block: {:<10} interval: {:<10}".format(number, interval), flush=True)
+
+    try:
+        trace_intervals(HTTPClient(rpc_address(node), timeout=10), int(start_bn), report, int(batch))
+    except KeyboardInterrupt:
+        pass
 
 
 def check_docker(arg):
@@ -1017,102 +1072,197 @@ def check_docker(arg):
         print("node(%s)      \t%s\t%s" % (node["host"], bn, bn1))
 
 
-def net_status(config_file):
+def net_status(config_file, timeout=5):
     with open(config_file) as infile:
         nodes = json.load(infile)
-        for node in nodes:
-            try:
-                if not need_point:
-                    cmd = "%s --verbosity 0 attach ws://%s:%s --exec net.peerCount" % (
-                        PLATON_BIN, node["host"], node["ws_port"])
-                else:
-                    cmd = "%s --verbosity 0 attach ws://%s:%s --exec 'net.peerCount'" % (
-                        PLATON_BIN, node["host"], node["ws_port"])
-                bn = run(cmd)
-                print(
-                    "%s(%s:%s)               \t%s"
-                    % (node["name"], node["host"], node["rpc_port"], bn.strip())
-                )
-            except Exception as e:
-                print(e)
-
-
-def get_accounts(config_file):
+
+    cluster = Cluster(nodes, float(timeout))
+    results = cluster.map(lambda client, node: to_int(client.call("net_peerCount")), float(timeout))
+    cluster.close()
+
+    status = []
+    for node, (peers, e) in zip(nodes, results):
+        print("%s(%s:%s)               \t%s" % (node["name"], node["host"], node["rpc_port"], e or peers))
+        status.append({"name": node["name"], "node": rpc_address(node), "peers": peers, "error": str(e) if e else None})
+
+    fp = open("./net_status.json", "w")
+    json.dump(status, fp, indent=2)
+    fp.close()
+
+
+def get_accounts(config_file, timeout=5):
     fp = open(config_file)
     nodes = json.load(fp)
     fp.close()
 
+    cluster = Cluster(nodes, float(timeout))
+    results = cluster.map(lambda client, node: client.call("platon_accounts"), float(timeout))
+    cluster.close()
+
     map_nodes = dict()
-    for n in nodes:
-        try:
-            if not need_point:
-                cmd = "%s --verbosity 0 attach http://%s:%s --exec platon.accounts" % (
-                    PLATON_BIN, n["host"], n["rpc_port"])
-            else:
-                cmd = "%s --verbosity 0 attach http://%s:%s --exec 'platon.accounts'" % (
-                    PLATON_BIN, n["host"], n["rpc_port"])
-            addr = (run(cmd)
-                    .strip()
-                    .strip("[")
-                    .strip("]")
-                    .strip('"')
-                    )
-            print(addr)
-            map_nodes[addr] = n
-        except Exception as e:
-            print(e)
+    for node, (accounts, e) in zip(nodes, results):
+        if e:
+            print("{} {}".format(node["name"], e))
             continue
+        for addr in accounts or []:
+            print(addr)
+            map_nodes[addr] = node
 
     fp = open("./accounts.txt", "w")
     json.dump(map_nodes, fp)
     fp.close()
 
 
-def prepare_qc(config_file):
+def prepare_qc(config_file, blocks=None, batch=100, timeout=10):
+    """
+    Prepare QCs of every node for one block ("181137") or a range of blocks
+    ("181000-181137"), the node's latest block by default, written to
+    prepare_qc.json as {node: {block: qc}}
+    :param config_file:
+    :param blocks:
+    :param batch: blocks per rpc request
+    :param timeout:
+    :return:
+    """
     fp = open(config_file)
     nodes = json.load(fp)
     fp.close()
 
-    fp = open("prepare.log", "w")
-
-    for n in nodes:
-        try:
-            if not need_point:
-                cmd = "%s --verbosity 0 attach http://%s:%s --exec platon.getPrepareQC(181137)" % (
-                    PLATON_BIN, n["host"], n["rpc_port"])
-            else:
-                cmd = "%s --verbosity 0 attach http://%s:%s --exec 'platon.getPrepareQC(181137)'" % (
-                    PLATON_BIN, n["host"], n["rpc_port"])
-            bn = run(cmd).strip()
-            print(bn)
-            fp.write("{}@{}:{}\n".format(n["name"], n["host"], n["rpc_port"]))
-            fp.write(bn)
-            fp.write("\n")
-        except Exception as e:
-            print(e)
+    first = last = None
+    if blocks is not None:
+        first, _, last = blocks.partition("-")
+        first = int(first)
+        last = int(last) if last else first
+
+    def perform(client, node):
+        lo, hi = first, last
+        if lo is None:
+            lo = hi = to_int(client.call("platon_blockNumber"))
+        qcs = dict()
+        for i in range(lo, hi + 1, int(batch)):
+            numbers = list(range(i, min(i + int(batch), hi + 1)))
+            for n, qc in zip(numbers, client.batch([("platon_getPrepareQC", [n]) for n in numbers])):
+                qcs[n] = {"error": str(qc)} if isinstance(qc, Exception) else qc
+        return qcs
+
+    # the latest block takes one extra round trip
+    rounds = 2 if first is None else (last - first) // int(batch) + 1
+    cluster = Cluster(nodes, float(timeout))
+    result = dict()
+    for node, qcs, e in cluster.as_completed(perform, float(timeout) * rounds):
+        name = "{}@{}".format(node["name"], rpc_address(node))
+        if e:
+            print("{} {}".format(name, e))
+            result[name] = {"error": str(e)}
             continue
+        missing = len([qc for qc in qcs.values() if not qc or "error" in qc])
+        print("{} blocks: {} missing: {}".format(name, len(qcs), missing))
+        result[name] = qcs
+    cluster.close()
 
-    fp.flush()
+    fp = open("prepare_qc.json", "w")
+    json.dump(result, fp, indent=2)
     fp.close()
 
 
-def df(config_file):
+DF_FIELDS = ["host", "mount", "nodes", "size", "used", "avail", "used_pct",
+             "inodes_pct", "chaindata", "mem_total", "mem_avail", "status"]
+
+
+def _disk_script(nodes):
+    """
+    One line per node: node <name> <mount> <size> <used> <avail> <itotal> <iused> <chaindata>
+    then: mem <total> <available>, all sizes in bytes
+    """
+    cmds = []
+    for node in nodes:
+        cmds += [
+            'd=%s; while [ ! -e "$d" ]; do d=$(dirname "$d"); done' % (node["path"]),
+            "c=$( (du -sb {0}/data/platon/chaindata 2>/dev/null || du -sb {0}/data 2>/dev/null || echo 0) | cut -f1)".format(node["path"]),
+            'echo node %s $(df -B1 --output=target,size,used,avail,itotal,iused "$d" | tail -1) $c' % (node["name"]),
+        ]
+    cmds.append("free -b | awk '/^Mem:/ {print \"mem\", $2, $7}'")
+    return cmds
+
+
+def df(config_file, warn=80, full=90):
+    """
+    Disk, inode, chaindata and memory usage of every host, collected in
+    parallel once per host into df_status.csv. A filesystem whose space or
+    inode usage reaches warn (full) percent is flagged WARN (FULL)
+    :param config_file:
+    :param warn:
+    :param full:
+    :return:
+    """
     fp = open(config_file)
     nodes = json.load(fp)
     fp.close()
+    warn = float(warn)
+    full = float(full)
 
-    fp = open("./df_status.log", "w")
-
+    hosts = dict()
     for node in nodes:
-        ssh = connect(node)
-        out = exec_cmd_return(ssh, "df -h", None)
-        fp.write(
-            "-----------------------------------------------------------------\n")
-        fp.write("{}:\n".format(node["host"]))
-        fp.writelines(out)
-        fp.flush()
+        hosts.setdefault(node["host"], []).append(node)
+
+    async def perform(ex, node):
+        return await ex.script(node, _disk_script(hosts[node["host"]]))
+
+    results = execute([h[0] for h in hosts.values()], perform, "df", report=False)
+
+    rows = []
+    for host, (out, e) in zip(hosts, results):
+        if e:
+            rows.append({"host": host, "status": "ERROR<{}>".format(e)})
+            continue
+        mem = [0, 0]
+        mounts = dict()
+        for line in out.splitlines():
+            ls = line.split()
+            if not ls:
+                continue
+            if ls[0] == "mem" and len(ls) == 3:
+                mem = [int(ls[1]), int(ls[2])]
+            elif ls[0] == "node" and len(ls) == 9 and all(v.isdigit() for v in ls[3:]):
+                size, used, avail, itotal, iused, chaindata = [int(v) for v in ls[3:]]
+                m = mounts.setdefault(ls[2], {
+                    "host": host,
+                    "mount": ls[2],
+                    "nodes": 0,
+                    "size": size,
+                    "used": used,
+                    "avail": avail,
+                    "used_pct": round(100.0 * used / (used + avail), 1) if used + avail else 0,
+                    "inodes_pct": round(100.0 * iused / itotal, 1) if itotal else 0,
+                    "chaindata": 0,
+                })
+                m["nodes"] = m["nodes"] + 1
+                m["chaindata"] = m["chaindata"] + chaindata
+        if not mounts:
+            rows.append({"host": host, "status": "ERROR<no data>"})
+            continue
+        for m in mounts.values():
+            m["mem_total"], m["mem_avail"] = mem
+            usage = max(m["used_pct"], m["inodes_pct"])
+            m["status"] = "FULL" if usage >= full else "WARN" if usage >= warn else "ok"
+            rows.append(m)
+
+    fp = open("./df_status.csv", "w")
+    fp.write(",".join(DF_FIELDS) + "\n")
+    for row in rows:
+        fp.write(",".join(str(row.get(f, "")) for f in DF_FIELDS) + "\n")
     fp.close()
 
+    print("{:<16} {:<20} {:>5} {:>8} {:>8} {:>7} {:>10} {:>8}  {}".format(
+        "Host", "Mount", "Nodes", "Used%", "Inode%", "Avail", "Chaindata", "MemAvail", "Status"))
+    for row in rows:
+        if "mount" not in row:
+            print("{:<16} {}".format(row["host"], row["status"]))
+            continue
+        print("{:<16} {:<20} {:>5} {:>8} {:>8} {:>6.0f}G {:>9.1f}G {:>7.1f}G  {}".format(
+            row["host"], row["mount"][:20], row["nodes"], row["used_pct"], row["inodes_pct"],
+            row["avail"] / 2 ** 30, row["chaindata"] / 2 ** 30, row["mem_avail"] / 2 ** 30, row["status"]))
+
 
 def restart_docker(config_file):
     fp = open(config_file)
@@ -2,6 +2,7 @@
 
 import sys
 import json
+import os
 
 num_accounts = 40
 num_consensus = 4
@@ -20,6 +21,16 @@ ws_port_range = (8808, 8851)
 pprof_port_range = (6608, 6651)
 fluent_port_range = (24231, 24324)
 
+KEYS_FILE = "./deploy-docker/keys.json"
+# key -> file name under ./deploy-docker/<name>/data
+KEY_FILES = {
+    "nodekey": "nodekey",
+    "pubkey": "pub",
+    "address": "addr",
+    "blskey": "blskey",
+    "blspub": "blspub",
+}
+
 
 def gen(nodes_file, config_file):
     key_fp = open("./tmpl/all_addr_and_private_keys.json")
@@ -181,35 +192,62 @@ def extend_nodes(result_nodes, remaining):
     return full_nodes
 
 
-def update_key(node_config):
-    def update(node):
-        blskey = ""
-        with open("{}/{}/data/blskey".format("./deploy-docker", node["name"])) as f:
-            blskey = f.read()
-            f.close()
-            node["blskey"] = blskey
-
-        nodekey = ""
-        with open("{}/{}/data/nodekey".format("./deploy-docker", node["name"])) as f:
-            nodekey = f.read()
-            f.close()
-            node["nodekey"] = nodekey
-        blspub = ""
-        with open("{}/{}/data/blspub".format("./deploy-docker", node["name"])) as f:
-            blspub = f.read()
-            f.close()
-            node["blspub"] = blspub
-
-        pubkey = ""
-        with open("{}/{}/data/pub".format("./deploy-docker", node["name"])) as f:
-            pubkey = f.read()
-            f.close()
-            node["pubkey"] = pubkey
+def load_keys():
+    """
+    The keys manifest written by ethkey_gen
+    :return: dict of node name -> {nodekey, pubkey, address, blskey, blspub}
+    """
+    if not os.path.isfile(KEYS_FILE):
+        return dict()
+    with open(KEYS_FILE) as f:
+        return json.load(f)
+
+
+def save_keys(keys):
+    os.makedirs(os.path.dirname(KEYS_FILE), exist_ok=True)
+    tmp = KEYS_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(keys, f, indent=2)
+    os.replace(tmp, KEYS_FILE)
+
+
+def read_key_files(name):
+    """
+    Keys of a node generated before the manifest existed, None if it has none
+    """
+    path = "./deploy-docker/{}/data".format(name)
+    keys = dict()
+    for key, file in KEY_FILES.items():
+        if not os.path.isfile("{}/{}".format(path, file)):
+            continue
+        with open("{}/{}".format(path, file)) as f:
+            keys[key] = f.read()
+    if "nodekey" not in keys or "blskey" not in keys:
+        return None
+    return keys
 
+
+def write_key_files(name, keys):
+    path = "./deploy-docker/{}/data".format(name)
+    os.makedirs(path, 0o755, exist_ok=True)
+    for key, file in KEY_FILES.items():
+        with open("{}/{}".format(path, file), "w") as f:
+            f.write(keys.get(key, ""))
+
+
+def apply_keys(node, keys):
+    node["nodekey"] = keys["nodekey"]
+    node["pubkey"] = keys["pubkey"]
+    node["blskey"] = keys["blskey"]
+    node["blspub"] = keys["blspub"]
+
+
+def update_key(node_config):
+    keys = load_keys()
     with open(node_config, "r") as infile:
         nodes = json.load(infile)
     for node in nodes:
-        update(node)
+        apply_keys(node, keys.get(node["name"]) or read_key_files(node["name"]))
     with open(node_config, "w") as outfile:
         json.dump(nodes, outfile, indent=2)
 
@@ -3,19 +3,37 @@
 
 """
 pip install ruamel.yaml
-pip install fabric
+pip install asyncssh
 """
 
-import concurrent.futures as futures
+import asyncio
 import json
 import os
 import sys
+import time
 
-import fabric
-from fabric import Connection
 from ruamel.yaml import YAML
 
+from async_executor import AsyncExecutor, execute, sha256
+
 DEPLOY_HOME = "./deploy-batch-gen"
+# a `docker save <registry>:<tag> | gzip` tarball loaded on the hosts instead
+# of pulling from the registry
+IMAGE_TAR = os.environ.get("LOADER_IMAGE_TAR")
+# when the loaders start: burst (all at once), linear (evenly over RAMP
+# seconds) or step (STEPS equal groups, RAMP / STEPS seconds apart), the
+# first one START_DELAY seconds after every host is connected
+START_PROFILE = os.environ.get("LOADER_START_PROFILE", "burst")
+RAMP = float(os.environ.get("LOADER_RAMP", 60))
+STEPS = int(os.environ.get("LOADER_STEPS", 4))
+START_DELAY = float(os.environ.get("LOADER_START_DELAY", 10))
+# the sender accounts, the staking nodes take their private keys from the
+# tail of the same list
+ACCOUNTS_FILE = "./tmpl/all_addr_and_private_keys.json"
+# random receiver addresses in the loader image (/data/1m_accounts.json, see
+# loader/entrypoint.sh), and at most how many of them one loader uses
+RAND_ADDRESSES = int(os.environ.get("LOADER_RAND_ADDRESSES", 1000000))
+RAND_COUNT = int(os.environ.get("LOADER_RAND_COUNT", 200000))
 
 """
 deploy batch
@@ -34,54 +52,280 @@ config.json:
   "nodekey": "1111",
   "delegate": true,
   "num_accounts": 40,
+  "capacity": 8
 }]
+
+capacity is optional, the relative load a host can generate (e.g. its cores),
+shared by the loaders on it. Every loader gets its num_accounts senders and
+LOADER_RAND_COUNT receivers while the pools last; a pool too small for that
+is shared by the same wanted counts weighted with the capacity.
 """
 
 
-def _connection(node):
-    kw = None
-    cfg = None
-    kw = {"password": node["passwd"]}
-    cfg = fabric.Config(overrides={"sudo": {"password": node["passwd"]}})
-    return Connection(host=node["host"], user=node["user"], connect_kwargs=kw, config=cfg)
+async def _stage(ex, node, tag, remote=None):
+    """
+    Make the loader image available on the node's host, pulled from the
+    registry or loaded from IMAGE_TAR uploaded to remote
+    """
+    if not IMAGE_TAR:
+        await ex.sudo(node, "docker pull {}:{}".format(node["registry"], tag), check=True)
+        return
+    out = await ex.run(node, "test -f {} && echo found".format(remote))
+    if "found" not in out:
+        await ex.put(node, IMAGE_TAR, remote + ".part")
+        await ex.run(node, "mv {0}.part {0}".format(remote), check=True)
+    await ex.sudo(node, "docker load -i " + remote, check=True)
 
 
-def put_file(node, tag):
-    c = _connection(node)
+async def put_file(ex, node):
+    remote = "/tmp/docker-compose-{}.yaml".format(node["name"])
     # upload file
-    c.put("{}/{}/docker-compose.yaml".format(DEPLOY_HOME,
-                                             node["name"]), "/tmp/docker-compose-{}.yaml".format(node["name"]),)
-    # pull docker image
-    c.sudo("docker pull {}:{}".format(node["registry"], tag), hide=True)
-    # make path
-    c.sudo("mkdir -p {}/{}".format(node["path"], node["name"]), hide=True)
-    # copy file
-    c.sudo("cp /tmp/docker-compose-{}.yaml {}/{}/docker-compose.yaml".format(
-        node["name"], node["path"], node["name"]), hide=True)
-    # run
-    c.sudo('bash -c "cd {}/{} && docker-compose up -d"'.format(
-        node["path"], node["name"]), hide=True)
-
-
-def batch_executor(nodes, perform, name):
-    with futures.ThreadPoolExecutor(max_workers=10) as executor:
-        i = 0
-        fs = []
-        for node in nodes:
-            if "boot" in node and node["boot"]:
-                continue
-            path = "{}/{}".format(DEPLOY_HOME, node["name"])
-            os.makedirs(name=path, mode=0o766, exist_ok=True)
-            fs.append((executor.submit(perform, node, i), (node["name"], node["host"])))
-            i = i + 1
-
-        for (f, n) in fs:
-            e = f.exception()
-            if e:
-                print("{} {}@{:<10} result: exception<{}>".format(
-                    name, n[0], n[1], e))
-            else:
-                print("{} {}@{:<10} result: success".format(name, n[0], n[1]))
+    await ex.put(node, "{}/{}/docker-compose.yaml".format(DEPLOY_HOME, node["name"]), remote)
+    await ex.script(node, [
+        # make path
+        "mkdir -p {}/{}".format(node["path"], node["name"]),
+        # copy file
+        "cp {} {}/{}/docker-compose.yaml".format(remote, node["path"], node["name"]),
+        # create the containers stopped, running ones included, they are
+        # started by schedule
+        "cd {}/{} && docker-compose stop && docker-compose up --no-start".format(node["path"], node["name"]),
+    ], check=True)
+
+
+def start_offsets(n, profile=START_PROFILE, ramp=RAMP, steps=STEPS):
+    """
+    Start offset in seconds of each of n loaders
+    """
+    if profile == "burst" or n < 2:
+        return [0.0] * n
+    if profile == "linear":
+        return [ramp * i / (n - 1) for i in range(n)]
+    if profile == "step":
+        return [ramp / steps * (i * steps // n) for i in range(n)]
+    raise ValueError("unknown start profile: {}".format(profile))
+
+
+def _fire_script(nodes, plan):
+    """
+    Start the created containers of the nodes of one host, each at its
+    planned time. The sleeps run on the host, so ssh latency does not skew
+    the start
+    """
+    cmds = []
+    for i, node in enumerate(nodes):
+        cmds.append("ids{}=$(cd {}/{} && docker-compose ps -q)".format(i, node["path"], node["name"]))
+    for i, node in enumerate(nodes):
+        cmds.append(
+            "(sleep $(awk -v t=%.3f -v n=$(date +%%s.%%N) 'BEGIN { d = t - n; print (d > 0 ? d : 0) }'); "
+            "docker start $ids%d > /dev/null && echo started %s $(date +%%s.%%N)) &"
+            % (plan[node["name"]], i, node["name"])
+        )
+    cmds.append("wait")
+    return cmds
+
+
+def schedule(loaders, name):
+    """
+    Start the created loaders following START_PROFILE and record the planned
+    and actual start times in DEPLOY_HOME/run.json
+    """
+    hosts = dict()
+    for node in loaders:
+        hosts.setdefault(node["host"], []).append(node)
+
+    plan = dict()
+    state = {"start_at": None, "arrived": set()}
+
+    def ready():
+        if "ready" not in state:
+            state["ready"] = asyncio.Event()
+        return state["ready"]
+
+    def arrive(host):
+        # the start time is fixed once every host is connected, however
+        # long the connects took
+        state["arrived"].add(host)
+        if len(state["arrived"]) < len(hosts) or ready().is_set():
+            return
+        start_at = state["start_at"] = time.time() + START_DELAY
+        for node, offset in zip(loaders, start_offsets(len(loaders))):
+            plan[node["name"]] = start_at + offset
+        print("{} start {} loaders at {} ({})".format(
+            name, len(loaders), time.strftime("%H:%M:%S", time.localtime(start_at)), START_PROFILE))
+        ready().set()
+
+    async def perform(ex, node):
+        try:
+            await ex.connection(node)
+        finally:
+            arrive(node["host"])
+        await ready().wait()
+        return await ex.script(node, _fire_script(hosts[node["host"]], plan))
+
+    # every host sleeps in its script until its last start, so all of them
+    # must run at once and none may be cut short by a timeout
+    ex = AsyncExecutor(limit=len(hosts), task_timeout=0, timeout=0)
+    results = ex.execute([h[0] for h in hosts.values()], perform, name + " start")
+
+    started = dict()
+    for out, e in results:
+        for line in (out or "").splitlines():
+            ls = line.split()
+            if len(ls) == 3 and ls[0] == "started":
+                started[ls[1]] = float(ls[2])
+
+    for node in loaders:
+        if node["name"] not in started:
+            print("{} {}@{:<10} result: not started".format(name, node["name"], node["host"]))
+
+    meta = {
+        "name": name,
+        "profile": START_PROFILE,
+        "ramp": RAMP,
+        "steps": STEPS,
+        "start_at": state["start_at"],
+        "nodes": [
+            {
+                "name": node["name"],
+                "host": node["host"],
+                "planned": plan.get(node["name"]),
+                "started": started.get(node["name"]),
+            }
+            for node in loaders
+        ],
+    }
+    with open("{}/run.json".format(DEPLOY_HOME), "w") as file:
+        json.dump(meta, file, indent=2)
+
+
+def _split(total, weights):
+    """
+    Split total into integer shares proportional to weights, by largest
+    remainder
+    """
+    s = sum(weights)
+    shares = [int(total * w / s) for w in weights]
+    rest = sorted(range(len(weights)), key=lambda i: shares[i] - total * weights[i] / s)
+    for i in rest[:total - sum(shares)]:
+        shares[i] = shares[i] + 1
+    return shares
+
+
+def _check_ranges(ranges, pool, what):
+    """
+    :param ranges: list of (name, start, count)
+    """
+    end = 0
+    for name, start, count in sorted(ranges, key=lambda r: r[1]):
+        if count <= 0:
+            raise ValueError("{}: no {} left".format(name, what))
+        if start < end:
+            raise ValueError("{}: {} range {}-{} overlaps another loader".format(name, what, start, start + count - 1))
+        end = start + count
+        if end > pool:
+            raise ValueError("{}: {} range {}-{} exceeds the {} available".format(name, what, start, end - 1, pool))
+
+
+def _allocate(wanted, weights, pool, what):
+    """
+    The wanted counts if the pool holds them all, otherwise the pool split
+    by wanted count times weight, none above its wanted count
+    """
+    if sum(wanted) <= pool:
+        return wanted
+    print("{} {} accounts wanted but only {} available, scaling down".format(sum(wanted), what, pool))
+    shares = _split(pool, [c * w for c, w in zip(wanted, weights)])
+    return [min(c, share) for c, share in zip(wanted, shares)]
+
+
+def plan_accounts(loaders, config):
+    """
+    Give every loader its own contiguous range of sender accounts (IDX,
+    COUNT) and of random receivers (R_IDX, RAND_COUNT), as shared out by
+    _allocate. The accounts holding staking keys are left out
+    :param loaders:
+    :param config: all nodes of the config file, for their staking keys
+    :return: dict of node name -> allocation
+    """
+    with open(ACCOUNTS_FILE) as file:
+        accounts = json.load(file)
+    staking_keys = set(node["private_key"] for node in config if node.get("private_key"))
+    pool = len(accounts)
+    for i, account in enumerate(accounts):
+        if account["private_key"] in staking_keys:
+            pool = min(pool, i)
+
+    per_host = dict()
+    capacity = dict()
+    for node in loaders:
+        c = float(node.get("capacity", 1))
+        if c <= 0:
+            raise ValueError("{}@{}: capacity must be positive, got {}".format(node["name"], node["host"], c))
+        per_host[node["host"]] = per_host.get(node["host"], 0) + 1
+        capacity[node["host"]] = max(capacity.get(node["host"], 0), c)
+    weights = [capacity[n["host"]] / per_host[n["host"]] for n in loaders]
+
+    wanted = _allocate([int(n.get("num_accounts", 50)) for n in loaders], weights, pool, "sender")
+    receivers = _allocate([RAND_COUNT] * len(loaders), weights, RAND_ADDRESSES, "receiver")
+
+    plan = dict()
+    idx = 0
+    r_idx = 0
+    for node, count, rand_count, weight in zip(loaders, wanted, receivers, weights):
+        plan[node["name"]] = {
+            "host": node["host"],
+            "weight": round(weight, 3),
+            "idx": idx,
+            "count": count,
+            "r_idx": r_idx,
+            "rand_count": rand_count,
+        }
+        idx = idx + count
+        r_idx = r_idx + rand_count
+    _check_ranges([(k, a["idx"], a["count"]) for k, a in plan.items()], pool, "sender")
+    _check_ranges([(k, a["r_idx"], a["rand_count"]) for k, a in plan.items()], RAND_ADDRESSES, "receiver")
+
+    with open("{}/plan.json".format(DEPLOY_HOME), "w") as file:
+        json.dump({"senders": pool, "receivers": RAND_ADDRESSES, "nodes": plan}, file, indent=2)
+    return plan
+
+
+def batch_executor(nodes, gen, name, tag, config=None):
+    """
+    Generate the compose file of every loader node with gen(node, alloc),
+    alloc being its account ranges from plan_accounts, stage the image once
+    per host, create the containers and start them all on schedule
+    :param config: all nodes of the config file, the accounts are only
+                   planned when given, otherwise alloc is None
+    """
+    loaders = [node for node in nodes if not node.get("boot")]
+    os.makedirs(DEPLOY_HOME, exist_ok=True)
+    allocs = plan_accounts(loaders, config) if config is not None else dict()
+    for node in loaders:
+        path = "{}/{}".format(DEPLOY_HOME, node["name"])
+        os.makedirs(name=path, mode=0o766, exist_ok=True)
+        gen(node, allocs.get(node["name"]))
+
+    remote = None
+    if IMAGE_TAR:
+        remote = "/tmp/loader-image-{}.tar.gz".format(sha256(IMAGE_TAR)[:16])
+
+    # a tarball holds the image whatever the registry, so it is loaded once per host
+    def stage_key(node):
+        return node["host"] if IMAGE_TAR else (node["host"], node["registry"])
+
+    hosts = dict()
+    for node in loaders:
+        hosts.setdefault(stage_key(node), node)
+    staged = execute(list(hosts.values()), lambda ex, node: _stage(ex, node, tag, remote), name + " stage")
+    failed = set(key for key, (r, e) in zip(hosts, staged) if e)
+
+    for node in loaders:
+        if stage_key(node) in failed:
+            print("{} {}@{:<10} result: skipped, image not staged".format(name, node["name"], node["host"]))
+    loaders = [n for n in loaders if stage_key(n) not in failed]
+    created = execute(loaders, put_file, name, summary="{}/{}-summary.json".format(DEPLOY_HOME, name))
+    schedule([n for n, (r, e) in zip(loaders, created) if not e], name)
 
 
 def delegate(cfg, tag="loader"):
@@ -92,11 +336,10 @@ def delegate(cfg, tag="loader"):
     cmd = "side_delegate"
     nodes = [node for node in old_nodes if not node.get("consensus")]
 
-    def perform(node, i):
-        _gen_docker_compose(node, tag, i, cmd)
-        put_file(node, tag)
+    def gen(node, alloc):
+        _gen_docker_compose(node, tag, alloc, cmd)
 
-    batch_executor(nodes, perform, delegate.__name__)
+    batch_executor(nodes, gen, delegate.__name__, tag, old_nodes)
 
 
 def transfer(cfg, tag="loader"):
@@ -106,11 +349,10 @@ def transfer(cfg, tag="loader"):
         file.close()
     cmd = "side_transfer"
 
-    def perform(node, idx):   
-        _gen_docker_compose(node, tag, idx, cmd)
-        put_file(node, tag)
+    def gen(node, alloc):
+        _gen_docker_compose(node, tag, alloc, cmd)
 
-    batch_executor(nodes, perform, transfer.__name__)
+    batch_executor(nodes, gen, transfer.__name__, tag, nodes)
 
 
 # def pro_transfer(cfg, tag="batch", send_txs=3, proportion=7):
@@ -155,8 +397,7 @@ def transfer(cfg, tag="loader"):
 #     batch_executor(nodes, perform, to_transfer.__name__)
 
 
-def _gen_docker_compose(node, tag, idx, cmd):
-    count = int(node.get("num_accounts", 50))
+def _gen_docker_compose(node, tag, alloc, cmd):
     nm = node["name"]
     if len(nm) > 30:
         nm = nm[:30]
@@ -170,8 +411,8 @@ def _gen_docker_compose(node, tag, idx, cmd):
                 "environment": {
                     "USE_CMD": cmd,
                     "URL": node.get("ws") or node.get("url"),
-                    "IDX": idx * count,
-                    "COUNT": count,
+                    "IDX": alloc["idx"],
+                    "COUNT": alloc["count"],
                     "NODEKEY": node["nodekey"],
                     "BLSKEY": node["blskey"],
                     "NODENAME": nm,
@@ -179,8 +420,8 @@ def _gen_docker_compose(node, tag, idx, cmd):
                     "ONLY_CONSENSUS_FLAG": "false",
                     "DELEGATE_FLAG": 'true',
                     "R_ACCOUNTS": "true",
-                    "RAND_COUNT": 200000,
-                    "R_IDX": idx * 200000,
+                    "RAND_COUNT": alloc["rand_count"],
+                    "R_IDX": alloc["r_idx"],
                     "CHAINID": 101,
                     # "SENDTXS": send_txs,
                     # "PROPORTION": proportion,
@@ -203,12 +444,10 @@ def staking(cfg, program_version, tag="loader"):
     nodes = []
     nodes = [node for node in old_nodes if node.get("staking")]
 
-    def perform(node, i):
+    def gen(node, alloc):
         _gen_staking_compose(node, tag, program_version)
 
-        put_file(node, tag)
-
-    batch_executor(nodes, perform, staking.__name__)
+    batch_executor(nodes, gen, staking.__name__, tag)
 
 
 def _gen_staking_compose(node, tag, program_version):
@@ -251,11 +490,10 @@ def wasm(cfg, tag="batch-wasm"):
     cmd = "side_wasm"
     contract_addr, invoke_data = "", ""
 
-    def perform(node, idx):
-        _gen_vm_docker_compose(node, tag, idx, cmd, contract_addr, invoke_data)
-        put_file(node, tag)
+    def gen(node, alloc):
+        _gen_vm_docker_compose(node, tag, alloc, cmd, contract_addr, invoke_data)
 
-    batch_executor(nodes, perform, wasm.__name__)
+    batch_executor(nodes, gen, wasm.__name__, tag, nodes)
 
 
 def evm(cfg, tag="batch-wasm"):
@@ -266,15 +504,13 @@ def evm(cfg, tag="batch-wasm"):
     cmd = "side_wasm"
     contract_addr, invoke_data = "", ""
 
-    def perform(node, idx):
-        _gen_vm_docker_compose(node, tag, idx, cmd, contract_addr, invoke_data)
-        put_file(node, tag)
+    def gen(node, alloc):
+        _gen_vm_docker_compose(node, tag, alloc, cmd, contract_addr, invoke_data)
 
-    batch_executor(nodes, perform, evm.__name__)
+    batch_executor(nodes, gen, evm.__name__, tag, nodes)
 
 
-def _gen_vm_docker_compose(node, tag, idx, cmd, contract_addr, invoke_data):
-    count = int(node.get("num_accounts", 50))
+def _gen_vm_docker_compose(node, tag, alloc, cmd, contract_addr, invoke_data):
     nm = node["name"]
     if len(nm) > 30:
         nm = nm[:30]
@@ -288,8 +524,8 @@ def _gen_vm_docker_compose(node, tag, idx, cmd, contract_addr, invoke_data):
                 "environment": {
                     "CMD": cmd,
                     "URL": node.get("ws") or node.get("url"),
-                    "IDX": idx * count,
-                    "COUNT": count,
+                    "IDX": alloc["idx"],
+                    "COUNT": alloc["count"],
                     "NODEKEY": node["nodekey"],
                     "BLSKEY": node["blskey"],
                     "NODENAME": nm,
@@ -297,8 +533,8 @@ def _gen_vm_docker_compose(node, tag, idx, cmd, contract_addr, invoke_data):
                     "ONLY_CONSENSUS_FLAG": "false",
                     "DELEGATE_FLAG": 'true',
                     "R_ACCOUNTS": "true",
-                    "RAND_COUNT": 200000,
-                    "R_IDX": idx * 200000,
+                    "RAND_COUNT": alloc["rand_count"],
+                    "R_IDX": alloc["r_idx"],
                     "CHAINID": 101,
                     "CONTRACT_ADDR": contract_addr,
                     "INVOKE_DATA": invoke_data,
@@ -314,99 +550,135 @@ def _gen_vm_docker_compose(node, tag, idx, cmd, contract_addr, invoke_data):
         file.close()
 
 
-def stop(cfg):
-    def perform(node, i):
-        c = _connection(node)
-        c.sudo('bash -c "docker-compose -f {}/{}/docker-compose.yaml stop"'.format(
-            node["path"], node["name"]), hide=True,)
+def _loader_nodes(cfg):
     with open(cfg, "rb") as file:
         nodes = json.load(file)
-        batch_executor(nodes, perform, stop.__name__)
+    return [node for node in nodes if not node.get("boot")]
 
 
-def start(cfg):
-    def perform(node, i):
-        c = _connection(node)
-        c.sudo('bash -c "docker-compose -f {}/{}/docker-compose.yaml start"'.format(
-            node["path"], node["name"]), hide=True,)
-    with open(cfg, "rb") as file:
-        nodes = json.load(file)
-        batch_executor(nodes, perform, start.__name__)
+def _compose(node, cmd):
+    return "docker-compose -f {}/{}/docker-compose.yaml {}".format(node["path"], node["name"], cmd)
 
 
-def remove(cfg):
-    def perform(node, i):
-        c = _connection(node)
-        # stop batch
-        c.sudo('bash -c "docker-compose -f {}/{}/docker-compose.yaml down"'.format(
-            node["path"], node["name"]), hide=True)
-        # remove directory
-        c.sudo(
-            "rm -f {}/{}/docker-compose.yaml".format(node["path"], node["name"]), hide=True)
-    with open(cfg, "rb") as file:
-        nodes = json.load(file)
-        file.close()
+def stop(cfg):
+    async def perform(ex, node):
+        await ex.sudo(node, _compose(node, "stop"), check=True)
 
-        batch_executor(nodes, perform, remove.__name__)
+    execute(_loader_nodes(cfg), perform, stop.__name__)
 
 
-def status(cfg):
-    def perform(node):
-        c = _connection(node)
-        return c.sudo(
-            'bash -c "cd {}/{} && docker-compose ps"'.format(
-                node["path"], node["name"]
-            ),
-            hide=True,
-        )
+def start(cfg):
+    async def perform(ex, node):
+        await ex.sudo(node, _compose(node, "start"), check=True)
 
-    file = open(cfg, "rb")
-    nodes = json.load(file)
-    file.close()
+    execute(_loader_nodes(cfg), perform, start.__name__)
 
-    with futures.ThreadPoolExecutor(max_workers=10) as executor:
-        fs = []
-        for node in nodes:
-            if "boot" in node and node["boot"]:
-                continue
-            fs.append(
-                (executor.submit(perform, node),
-                    (node["name"], node["host"]))
-            )
-        for (f, n) in fs:
-            e = f.exception()
-            if e:
-                print("{}@{:<10} exception<{}>".format(n[0], n[1], e))
-            else:
-                res = f.result().stdout
-                ls = res.split("\n")
-                r = "NotExist"
-                if len(ls) > 2:
-                    ll = ls[2].split()
-                    r = ll[2]
 
-                print("{}@{:<10} {}".format(n[0], n[1], r))
+def remove(cfg):
+    async def perform(ex, node):
+        await ex.script(node, [
+            # stop batch
+            _compose(node, "down"),
+            # remove directory
+            "rm -f {}/{}/docker-compose.yaml".format(node["path"], node["name"]),
+        ], check=True)
+
+    execute(_loader_nodes(cfg), perform, remove.__name__)
+
+
+def _container_names(node):
+    """
+    Names of the containers the generated compose files give the node
+    """
+    nm = node["name"][:30]
+    return [nm + "-batch", nm + "-batch-staking"]
+
+
+STATUS_SCRIPT = [
+    "docker ps -a --format '{{json .}}'",
+    "echo '#stats'",
+    "docker stats --no-stream --format '{{json .}}'",
+    "echo '#inspect'",
+    "ids=$(docker ps -aq)",
+    "[ -z \"$ids\" ] || docker inspect --format '{{.Name}} {{.RestartCount}}' $ids",
+]
+
+
+def _parse_status(out):
+    """
+    :return: dict of container name -> {state, status, cpu, mem, restarts}
+    """
+    containers = dict()
+    section = "ps"
+    for line in out.splitlines():
+        line = line.strip()
+        if line.startswith("#"):
+            section = line[1:]
+        elif not line:
+            continue
+        elif section == "ps":
+            c = json.loads(line)
+            # State is missing before docker 19, the status starts with it
+            state = c.get("State") or c["Status"].split()[0].lower()
+            containers[c["Names"]] = {"state": state, "status": c["Status"], "cpu": "-", "mem": "-", "restarts": "-"}
+        elif section == "stats":
+            c = json.loads(line)
+            if c["Name"] in containers:
+                containers[c["Name"]]["cpu"] = c["CPUPerc"]
+                containers[c["Name"]]["mem"] = c["MemUsage"].split(" / ")[0]
+        elif section == "inspect":
+            name, restarts = line.split()
+            if name.lstrip("/") in containers:
+                containers[name.lstrip("/")]["restarts"] = int(restarts)
+    return containers
+
+
+def status(cfg):
+    """
+    State, cpu, memory and restart count of every loader container, from one
+    ssh call per host listing all the containers on it
+    """
+    nodes = _loader_nodes(cfg)
+    hosts = dict()
+    for node in nodes:
+        hosts.setdefault(node["host"], []).append(node)
+
+    async def perform(ex, node):
+        return _parse_status(await ex.script(node, STATUS_SCRIPT, check=True))
+
+    os.makedirs(DEPLOY_HOME, exist_ok=True)
+    results = execute([h[0] for h in hosts.values()], perform, status.__name__, report=False,
+                      summary="{}/status-summary.json".format(DEPLOY_HOME))
+
+    print("{:<32} {:<16} {:<10} {:<24} {:<8} {:<10} {:<8}".format(
+        "Container", "Host", "State", "Status", "CPU", "Mem", "Restarts"))
+    for (host, host_nodes), (containers, e) in zip(hosts.items(), results):
+        for node in host_nodes:
+            if e:
+                print("{:<32} {:<16} ERROR<{}>".format(node["name"], host, e))
+                continue
+            found = [n for n in _container_names(node) if n in containers]
+            if not found:
+                print("{:<32} {:<16} {:<10}".format(node["name"][:30] + "-batch", host, "NotExist"))
+            for name in found:
+                c = containers[name]
+                print("{:<32} {:<16} {:<10} {:<24} {:<8} {:<10} {:<8}".format(
+                    name, host, c["state"], c["status"][:24], c["cpu"], c["mem"], c["restarts"]))
 
 
 def prune(cfg):
-    def perform(node, i):
-        c = _connection(node)
-        c.run('bash -c "docker container prune -f"')
+    async def perform(ex, node):
+        await ex.run(node, "docker container prune -f", check=True)
     file = open(cfg, "rb")
     old_nodes = json.load(file)
     file.close()
-    nodes = []
-
-    def check_had(n):
-        for nod in nodes:
-            if n["host"] == nod["host"]:
-                return True
-        return False
 
+    hosts = dict()
     for node in old_nodes:
-        if not check_had(node):
-            nodes.append(node)
-    batch_executor(nodes, perform, prune.__name__)
+        if "boot" in node and node["boot"]:
+            continue
+        hosts.setdefault(node["host"], node)
+    execute(list(hosts.values()), perform, prune.__name__)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+#
+
+"""
+JSON-RPC fan-out over the nodes of a cluster
+
+Every node gets one keep-alive http connection to http://<host>:<rpc_port>,
+several calls to the same node are sent as one batch request and the nodes
+are queried concurrently from a thread pool.
+
+Example:
+cluster = Cluster(nodes)
+for node, result, e in cluster.as_completed(lambda c, n: c.call("platon_blockNumber")):
+    print(node["name"], to_int(result))
+cluster.close()
+"""
+
+import concurrent.futures as futures
+import http.client
+import itertools
+import json
+import socket
+import threading
+
+
+class RPCError(Exception):
+    pass
+
+
+def to_int(v):
+    if isinstance(v, str):
+        return int(v, 16) if v.startswith("0x") else int(v)
+    return v
+
+
+def _result(resp):
+    if "error" in resp:
+        raise RPCError("{}: {}".format(resp["error"].get("code"), resp["error"].get("message")))
+    return resp.get("result")
+
+
+def rpc_address(node):
+    return "{}:{}".format(node["host"], node["rpc_port"])
+
+
+class HTTPClient:
+    def __init__(self, netloc, timeout=5):
+        self.netloc = netloc
+        self.timeout = timeout
+        self.conn = None
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def _post(self, payload):
+        data = json.dumps(payload).encode("utf8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+            try:
+                self.conn.request("POST", "/", body=data, headers=headers)
+                resp = self.conn.getresponse()
+                return json.loads(resp.read())
+            except socket.timeout:
+                self.close()
+                raise
+            except (OSError, http.client.HTTPException):
+                self.close()
+                # retry once on a stale keep-alive connection
+                if attempt > 0:
+                    raise
+
+    def call(self, method, *params):
+        return _result(self._post({"jsonrpc": "2.0", "id": next(self.ids), "method": method, "params": list(params)}))
+
+    def batch(self, calls):
+        """
+        :param calls: list of (method, params)
+        :return: list of results in the order of calls, an RPCError in
+                 place of a failed call
+        """
+        if not calls:
+            return []
+        reqs = [
+            {"jsonrpc": "2.0", "id": next(self.ids), "method": m, "params": list(p)}
+            for (m, p) in calls
+        ]
+        resps = {r["id"]: r for r in self._post(reqs)}
+        results = []
+        for r in reqs:
+            try:
+                results.append(_result(resps[r["id"]]))
+            except RPCError as e:
+                results.append(e)
+        return results
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+
+
+class Cluster:
+    def __init__(self, nodes, timeout=5, workers=64):
+        self.nodes = nodes
+        self.clients = [HTTPClient(rpc_address(node), timeout) for node in nodes]
+        self.executor = futures.ThreadPoolExecutor(max_workers=max(1, min(len(nodes), workers)))
+
+    def _perform(self, client, node, perform):
+        # a node still busy with a call from an earlier round is skipped
+        if not client.lock.acquire(blocking=False):
+            raise RPCError("busy")
+        try:
+            return perform(client, node)
+        finally:
+            client.lock.release()
+
+    def as_completed(self, perform, timeout=None):
+        """
+        Run perform(client, node) for every node concurrently
+        :param timeout: seconds to wait for all nodes, the late ones are
+                        reported with a TimeoutError
+        :return: generator of (node, result, exception) as the nodes answer
+        """
+        fs = dict()
+        for client, node in zip(self.clients, self.nodes):
+            fs[self.executor.submit(self._perform, client, node, perform)] = node
+        done = set()
+        try:
+            for f in futures.as_completed(fs, timeout):
+                done.add(f)
+                e = f.exception()
+                yield fs[f], None if e else f.result(), e
+        except futures.TimeoutError:
+            for f, node in fs.items():
+                if f not in done:
+                    yield node, None, futures.TimeoutError("no response in {}s".format(timeout))
+
+    def map(self, perform, timeout=None):
+        """
+        :return: list of (result, exception) in the order of nodes
+        """
+        index = {id(node): i for i, node in enumerate(self.nodes)}
+        results = [None] * len(self.nodes)
+        for node, result, e in self.as_completed(perform, timeout):
+            results[index[id(node)]] = (result, e)
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for client in self.clients:
+            # a busy client is left to its socket timeout
+            if client.lock.acquire(blocking=False):
+                client.close()
+                client.lock.release()